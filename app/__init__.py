@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -8,8 +9,34 @@ SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# 应用启动时开启后台任务，关闭时停止
+@asynccontextmanager
+async def lifespan(app):
+    from app.services.estimate_refresher import estimate_refresher
+    from app.services.gold_kline_store import gold_kline_ingester
+    from app.services.fund_master import fund_master_refresher
+    from app.services.hot_funds import hot_fund_board
+    from app.services.history_service import history_syncer
+    from app.services.http_client import close_session
+    from app.database import pool
+    from app.utils import password_hasher
+    estimate_refresher.start()
+    gold_kline_ingester.start()
+    fund_master_refresher.start()
+    hot_fund_board.start()
+    history_syncer.start()
+    yield
+    await estimate_refresher.stop()
+    await gold_kline_ingester.stop()
+    await fund_master_refresher.stop()
+    await hot_fund_board.stop()
+    await history_syncer.stop()
+    close_session()
+    pool.close_all()
+    password_hasher.shutdown()
+
 # 创建 FastAPI 应用实例
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # 允许跨域请求
 app.add_middleware(
@@ -28,9 +55,10 @@ static_dir.mkdir(exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # 导入API路由
-from app.api import auth, funds, gold
+from app.api import auth, funds, gold, portfolio
 
 # 注册路由
 app.include_router(auth.router, prefix="/api", tags=["auth"])
 app.include_router(funds.router, prefix="/api", tags=["funds"])
 app.include_router(gold.router, prefix="/api", tags=["gold"])
+app.include_router(portfolio.router, prefix="/api", tags=["portfolio"])
@@ -1,10 +1,14 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from typing import Optional
+from collections import OrderedDict
 import datetime
+import sqlite3
+import threading
+import time
 from app.models import User, UserInDB, Token, TokenData
-from app.database import get_db, close_db
-from app.utils import verify_password, get_password_hash, create_access_token, decode_token
+from app.database import get_conn
+from app.utils import create_access_token, decode_token, password_hasher
 
 router = APIRouter(tags=["auth"])
 
@@ -12,32 +16,102 @@ router = APIRouter(tags=["auth"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
 
 # 获取用户
-def get_user(username: str):
-    conn = get_db()
+def get_user(conn, username: str):
     cursor = conn.cursor()
     cursor.execute("SELECT id, username, password FROM users WHERE username = ?", (username,))
     user = cursor.fetchone()
-    conn.close()
     if user:
         return UserInDB(id=user[0], username=user[1], password=user[2])
     return None
 
-# 认证用户
-def authenticate_user(username: str, password: str):
-    user = get_user(username)
+# 认证用户，bcrypt 成本参数变化时顺便更新密码哈希
+async def authenticate_user(conn, username: str, password: str):
+    user = get_user(conn, username)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    verified, new_hash = await password_hasher.verify_and_update(password, user.password)
+    if not verified:
         return False
+    if new_hash:
+        conn.execute("UPDATE users SET password = ? WHERE id = ?", (new_hash, user.id))
+        conn.commit()
+        user.password = new_hash
     return user
 
+# 已验证令牌的缓存时间（秒），超过后重新查询用户
+TOKEN_CACHE_TTL = 60
+# 最多缓存的令牌数量
+TOKEN_CACHE_SIZE = 1024
+
+class TokenCache:
+    """
+    令牌签名 -> (用户, 令牌过期时间, 缓存过期时间)
+    令牌本身过期后立即失效，修改密码或删除用户时按用户名清除
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str):
+        # JWT 的第三段是签名，同一签名必然对应同一载荷
+        return token.rsplit(".", 1)[-1]
+
+    def get(self, token: str):
+        key = self.key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            user, expires_at, cached_until = entry
+            if now >= expires_at or now >= cached_until:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return user
+
+    def put(self, token: str, user: UserInDB, expires_at: float):
+        key = self.key(token)
+        with self._lock:
+            self._data[key] = (user, expires_at, time.time() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate_user(self, username: str):
+        with self._lock:
+            for key in [key for key, entry in self._data.items() if entry[0].username == username]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl}
+
+token_cache = TokenCache()
+
+# 清除用户的令牌缓存，修改密码或删除用户后需要调用
+def invalidate_user_tokens(username: str):
+    token_cache.invalidate_user(username)
+
 # 获取当前用户
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_current_user(token: str = Depends(oauth2_scheme), conn: sqlite3.Connection = Depends(get_conn)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # 命中缓存时跳过令牌解码和数据库查询
+    user = token_cache.get(token)
+    if user is not None:
+        return user
     try:
         payload = decode_token(token)
         username: str = payload.get("sub")
@@ -46,33 +120,32 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(username=username)
     except Exception:
         raise credentials_exception
-    user = get_user(username=token_data.username)
+    user = get_user(conn, username=token_data.username)
     if user is None:
         raise credentials_exception
+    token_cache.put(token, user, payload.get("exp") or time.time())
     return user
 
 # API端点：用户注册
 @router.post("/register")
-async def register(user: User):
+async def register(user: User, conn: sqlite3.Connection = Depends(get_conn)):
     # 检查用户是否已存在
-    existing_user = get_user(user.username)
+    existing_user = get_user(conn, user.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="用户名已存在")
     
     # 创建新用户
-    hashed_password = get_password_hash(user.password)
-    conn = get_db()
+    hashed_password = await password_hasher.hash(user.password)
     cursor = conn.cursor()
     cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (user.username, hashed_password))
     conn.commit()
-    conn.close()
     
     return {"message": "注册成功"}
 
 # API端点：获取访问令牌
 @router.post("/token", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), conn: sqlite3.Connection = Depends(get_conn)):
+    user = await authenticate_user(conn, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -83,4 +156,12 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer"}
+
+# API端点：认证相关统计（密码哈希队列、令牌缓存）
+@router.get("/auth/stats")
+async def get_auth_stats():
+    return {
+        "password_hasher": password_hasher.stats(),
+        "token_cache": token_cache.stats()
+    }
\ No newline at end of file
@@ -1,203 +1,297 @@
-from fastapi import APIRouter, HTTPException, Depends, Query, File, UploadFile
-from fastapi.responses import Response
-from typing import List
-import csv
-import io
-from app.models import Fund, FundAmountUpdate
-from app.database import get_db, close_db
-from app.services.fund_service import get_fund_estimate, generate_mock_history_data
+from fastapi import APIRouter, HTTPException, Depends, Query, File, UploadFile, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+import datetime
+import json
+import time
+import sqlite3
+from urllib.parse import quote
+from app.models import Fund, FundAmountUpdate, Trade
+from app.database import get_db, close_db, get_conn
+from app.services.fund_service import get_fund_estimate, get_fund_type_and_sector, get_fund_estimates, get_fund_estimates_async, generate_mock_history_data
+from app.services.ledger_service import apply_trade, get_transactions, TradeError, TRANSACTIONS_LIMIT, SHARES_EPSILON
+from app.services.import_service import import_holdings
+from app.services.fund_master import search_fund_master, SEARCH_LIMIT
+from app.services.export_service import export_stream, check_export, EXPORT_FORMATS, EXPORT_FORMAT_PATTERN, EXPORT_DATASET_PATTERN
+from app.services.estimate_cache import estimate_cache, estimate_ttl, estimate_backoff
+from app.services.http_client import breaker_stats
+from app.services.history_service import get_nav_history, history_syncer, HISTORY_DAYS
+from app.services.estimate_refresher import estimate_refresher
+from app.services.hot_funds import hot_fund_board
 from app.api.auth import get_current_user, UserInDB
+from app.utils import decode_token
+from app.utils.http_cache import make_etag, request_key, cache_headers, not_modified
+from app.utils.timeseries import build_series_response, SeriesParams, DAILY_INTERVAL_PATTERN
 
 router = APIRouter(tags=["funds"])
 
-# API端点：获取所有基金
-@router.get("/funds")
-async def get_funds(current_user: UserInDB = Depends(get_current_user)):
-    conn = get_db()
+# 单次批量交易的最大笔数
+TRADE_BATCH_LIMIT = 1000
+# 推送连接的心跳间隔（秒）
+STREAM_KEEPALIVE = 15
+# 历史数据的数值列
+OHLC_FIELDS = ("open", "close", "high", "low", "price")
+# 历史净值的浏览器缓存时间（秒），净值每天收盘后才更新一次
+FUND_HISTORY_MAX_AGE = 3600
+
+# 组合持仓行与实时净值预估
+def build_holding(fund, estimate_data):
+    # 计算当前市值
+    nav = float(estimate_data["estimate"]) if estimate_data["estimate"] != "-" else 1.0
+    # 正确的计算应该是使用份额乘以当前净值
+    shares = fund[3] if len(fund) > 3 else 0
+    current_value = shares * nav if shares > 0 else 0
+    return {
+        "code": fund[0],
+        "name": fund[1],
+        "amount": fund[2],
+        "shares": fund[3] if len(fund) > 3 else 0,
+        "estimate": estimate_data["estimate"],
+        "estimate_change": estimate_data["estimate_change"],
+        "time": estimate_data["time"],
+        "type": estimate_data["type"],
+        "sector": estimate_data["sector"],
+        "stale": estimate_data.get("stale", False),
+        "current_value": current_value
+    }
+
+# 获取用户持有的基金及实时净值预估
+async def get_holdings(conn, user_id):
     cursor = conn.cursor()
-    cursor.execute("SELECT code, name, amount, shares FROM funds WHERE user_id = ?", (current_user.id,))
+    cursor.execute("SELECT code, name, amount, shares FROM funds WHERE user_id = ?", (user_id,))
     funds = cursor.fetchall()
-    conn.close()
     
-    # 获取每个基金的实时净值预估
-    result = []
-    for fund in funds:
-        estimate_data = get_fund_estimate(fund[0])
-        # 计算当前市值
-        nav = float(estimate_data["estimate"]) if estimate_data["estimate"] != "-" else 1.0
-        # 正确的计算应该是使用份额乘以当前净值
-        shares = fund[3] if len(fund) > 3 else 0
-        current_value = shares * nav if shares > 0 else 0
-        result.append({
-            "code": fund[0],
-            "name": fund[1],
-            "amount": fund[2],
-            "shares": fund[3] if len(fund) > 3 else 0,
-            "estimate": estimate_data["estimate"],
-            "estimate_change": estimate_data["estimate_change"],
-            "time": estimate_data["time"],
-            "type": estimate_data["type"],
-            "sector": estimate_data["sector"],
-            "current_value": current_value
-        })
-    return result
+    # 并发获取每个基金的实时净值预估
+    estimates = await get_fund_estimates_async([fund[0] for fund in funds])
+    return [build_holding(fund, estimates[fund[0]]) for fund in funds]
+
+# API端点：获取所有基金
+@router.get("/funds")
+async def get_funds(current_user: UserInDB = Depends(get_current_user), conn: sqlite3.Connection = Depends(get_conn)):
+    return await get_holdings(conn, current_user.id)
+
+# API端点：推送持仓基金的实时净值变化（Server-Sent Events）
+@router.get("/funds/stream")
+async def stream_funds(request: Request, token: str = Query(..., description="访问令牌")):
+    # EventSource 无法设置请求头，令牌通过查询参数传递
+    conn = get_db()
+    try:
+        current_user = await get_current_user(token, conn)
+    finally:
+        close_db(conn)
+    expires_at = decode_token(token).get("exp") or time.time()
+
+    async def events():
+        sent = None
+        version = estimate_refresher.version
+        changed = True
+        while not await request.is_disconnected():
+            remaining = expires_at - time.time()
+            if remaining <= 0:
+                # 令牌过期后关闭连接，客户端重新登录后再订阅
+                yield "event: expired\ndata: {}\n\n"
+                break
+            if not changed:
+                # 估值没有刷新时只发心跳，避免代理断开空闲连接
+                yield ": keepalive\n\n"
+            else:
+                # 长连接不占用数据库连接，每次推送前临时获取
+                conn = get_db()
+                try:
+                    holdings = await get_holdings(conn, current_user.id)
+                finally:
+                    close_db(conn)
+                current = {fund["code"]: fund for fund in holdings}
+                # 首次推送全部持仓，之后只推送有变化的基金
+                previous = sent or {}
+                updated = [fund for code, fund in current.items() if previous.get(code) != fund]
+                removed = [code for code in previous if code not in current]
+                if updated or removed or sent is None:
+                    payload = {"full": sent is None, "updated": updated, "removed": removed}
+                    yield f"event: funds\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                else:
+                    yield ": keepalive\n\n"
+                sent = current
+            latest = await estimate_refresher.wait_for_tick(version, timeout=min(STREAM_KEEPALIVE, remaining))
+            changed = latest != version
+            version = latest
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# 交易使用的净值：优先使用请求指定的净值
+# 估算净值已过期或为模拟数据时拒绝交易，不可靠的价格一旦写入只追加的交易流水就无法更正
+def trade_nav(estimate_data, nav=None):
+    if nav is not None:
+        return nav
+    if not estimate_data or estimate_data.get("stale") or estimate_data.get("estimate") in (None, "-"):
+        raise TradeError("暂时无法获取可靠的估算净值，请指定成交净值 nav")
+    return float(estimate_data["estimate"])
 
 # API端点：添加基金
 @router.post("/funds")
-async def add_fund(fund: Fund, current_user: UserInDB = Depends(get_current_user)):
-    conn = get_db()
+async def add_fund(fund: Fund, current_user: UserInDB = Depends(get_current_user), conn: sqlite3.Connection = Depends(get_conn)):
     cursor = conn.cursor()
     
     # 检查基金是否已存在
     cursor.execute("SELECT id FROM funds WHERE user_id = ? AND code = ?", (current_user.id, fund.code))
     existing_fund = cursor.fetchone()
     if existing_fund:
-        conn.close()
         raise HTTPException(status_code=400, detail="基金已存在")
     
-    # 获取当前净值
-    estimate_data = get_fund_estimate(fund.code)
-    nav = float(estimate_data["estimate"]) if estimate_data["estimate"] != "-" else 1.0
-    
-    # 计算份额
-    shares = fund.amount / nav if nav > 0 else 0
+    # 获取当前净值，指定了成交净值或不买入时不需要估值
+    estimate_data = None
+    if fund.amount > 0 and fund.nav is None:
+        estimate_data = await run_in_threadpool(get_fund_estimate, fund.code)
     
-    # 添加新基金
-    cursor.execute("INSERT INTO funds (user_id, code, name, amount, shares) VALUES (?, ?, ?, ?, ?)", 
-                  (current_user.id, fund.code, fund.name, fund.amount, shares))
+    # 添加新基金并记录首笔买入，并发添加同一基金时由唯一索引拦截
+    shares = 0
+    try:
+        if fund.amount > 0:
+            trade = apply_trade(conn, current_user.id, fund.code, "buy", trade_nav(estimate_data, fund.nav),
+                                amount=fund.amount, name=fund.name)
+            shares = trade["shares"]
+        else:
+            cursor.execute("INSERT INTO funds (user_id, code, name, amount, shares) VALUES (?, ?, ?, ?, ?)", 
+                          (current_user.id, fund.code, fund.name, fund.amount, shares))
+    except TradeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=400, detail="基金已存在")
     conn.commit()
-    conn.close()
     
     return {"message": "基金添加成功", "fund": fund, "shares": shares}
 
 # API端点：删除基金
 @router.delete("/funds/{code}")
-async def delete_fund(code: str, current_user: UserInDB = Depends(get_current_user)):
-    conn = get_db()
+async def delete_fund(code: str, current_user: UserInDB = Depends(get_current_user), conn: sqlite3.Connection = Depends(get_conn)):
     cursor = conn.cursor()
     
-    # 查找并删除基金
-    cursor.execute("DELETE FROM funds WHERE user_id = ? AND code = ?", (current_user.id, code))
+    # 只删除已清仓的基金，仍有份额时删除会使持仓与交易流水不一致，需先卖出全部份额
+    cursor.execute("DELETE FROM funds WHERE user_id = ? AND code = ? AND shares < ?",
+                   (current_user.id, code, SHARES_EPSILON))
     if cursor.rowcount == 0:
-        conn.close()
-        raise HTTPException(status_code=404, detail="基金不存在")
+        cursor.execute("SELECT 1 FROM funds WHERE user_id = ? AND code = ?", (current_user.id, code))
+        if cursor.fetchone() is None:
+            raise HTTPException(status_code=404, detail="基金不存在")
+        raise HTTPException(status_code=400, detail="基金仍有持有份额，请先卖出全部份额再删除")
     
     conn.commit()
-    conn.close()
     
     return {"message": "基金删除成功", "code": code}
 
 # API端点：为基金追加金额或卖出
 @router.put("/funds/{code}/amount")
-async def update_fund_amount(code: str, amount_data: FundAmountUpdate, current_user: UserInDB = Depends(get_current_user)):
-    conn = get_db()
+async def update_fund_amount(code: str, amount_data: FundAmountUpdate, current_user: UserInDB = Depends(get_current_user), conn: sqlite3.Connection = Depends(get_conn)):
     cursor = conn.cursor()
     
-    # 检查基金是否存在并获取当前金额和份额
-    cursor.execute("SELECT amount, shares FROM funds WHERE user_id = ? AND code = ?", (current_user.id, code))
+    # 检查基金是否存在
+    cursor.execute("SELECT shares FROM funds WHERE user_id = ? AND code = ?", (current_user.id, code))
     fund = cursor.fetchone()
     if not fund:
-        conn.close()
         raise HTTPException(status_code=404, detail="基金不存在")
+    held = fund[0] or 0
+    if amount_data.sell_all and held < SHARES_EPSILON:
+        raise HTTPException(status_code=400, detail="基金没有可卖出的份额")
     
-    # 获取操作类型和金额
-    is_sell = amount_data.sell
-    amount = amount_data.amount
-    current_amount = fund[0] or 0
-    current_shares = fund[1] or 0
+    # 获取当前净值，指定了成交净值时不需要估值
+    estimate_data = None
+    if amount_data.nav is None:
+        estimate_data = await run_in_threadpool(get_fund_estimate, code)
     
-    # 获取当前净值
-    estimate_data = get_fund_estimate(code)
-    nav = float(estimate_data["estimate"]) if estimate_data["estimate"] != "-" else 1.0
+    # 买入或卖出 amount 金额对应的份额（全部卖出时按持有份额），卖出时按持仓成本计算已实现盈亏
+    sell = amount_data.sell or amount_data.sell_all
+    side = "sell" if sell else "buy"
+    try:
+        nav = trade_nav(estimate_data, amount_data.nav)
+        if amount_data.sell_all:
+            trade = apply_trade(conn, current_user.id, code, side, nav, shares=held)
+        else:
+            trade = apply_trade(conn, current_user.id, code, side, nav, amount=amount_data.amount)
+    except TradeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    conn.commit()
     
-    if is_sell:
-        # 卖出操作：计算卖出的份额
-        if amount < 0:
-            conn.close()
-            raise HTTPException(status_code=400, detail="卖出后金额不能为负")
-        # 计算卖出的份额
-        sell_shares = amount / nav if nav > 0 else 0
-        new_shares = current_shares - sell_shares
-        new_amount = amount
-        message = "基金卖出成功"
-    else:
-        # 买入操作：计算新增的份额
-        if amount <= 0:
-            conn.close()
-            raise HTTPException(status_code=400, detail="追加金额必须大于0")
-        buy_shares = amount / nav if nav > 0 else 0
-        new_shares = current_shares + buy_shares
-        new_amount = current_amount + amount
-        message = "金额追加成功"
+    holding = trade["holding"]
+    message = "基金卖出成功" if sell else "金额追加成功"
+    return {
+        "message": message,
+        "code": code,
+        "new_amount": holding["amount"],
+        "new_shares": holding["shares"],
+        "realized_pnl": holding["realized_pnl"],
+        "transaction": trade
+    }
+
+# API端点：批量交易，所有交易在同一个事务中执行，任意一笔失败时全部回滚
+@router.post("/funds/trades")
+async def batch_trades(trades: List[Trade], current_user: UserInDB = Depends(get_current_user), conn: sqlite3.Connection = Depends(get_conn)):
+    if not trades:
+        raise HTTPException(status_code=400, detail="交易列表不能为空")
+    if len(trades) > TRADE_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"单次最多提交{TRADE_BATCH_LIMIT}笔交易")
     
-    # 更新基金金额和份额
-    cursor.execute("UPDATE funds SET amount = ?, shares = ? WHERE user_id = ? AND code = ?", 
-                  (new_amount, new_shares, current_user.id, code))
-    conn.commit()
-    conn.close()
+    # 在开启写事务之前获取未指定净值的交易所需的估算净值
+    codes = [trade.code for trade in trades if trade.nav is None]
+    estimates = await run_in_threadpool(get_fund_estimates, codes) if codes else {}
     
-    return {"message": message, "code": code, "new_amount": new_amount, "new_shares": new_shares}
+    results = []
+    try:
+        for index, trade in enumerate(trades):
+            try:
+                nav = trade_nav(estimates.get(trade.code), trade.nav)
+                results.append(apply_trade(conn, current_user.id, trade.code, trade.side, nav,
+                                           amount=trade.amount, shares=trade.shares, name=trade.name))
+            except TradeError as e:
+                raise HTTPException(status_code=400, detail=f"第{index + 1}笔交易失败: {e}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    return {"message": f"成功执行 {len(results)} 笔交易", "trades": results}
 
-# API端点：获取基金历史净值数据
-@router.get("/funds/{code}/history")
-async def get_fund_history(code: str):
+# API端点：基金交易流水
+@router.get("/funds/{code}/transactions")
+async def list_transactions(
+    code: str,
+    limit: int = Query(TRANSACTIONS_LIMIT, ge=1, le=1000, description="返回的交易条数"),
+    current_user: UserInDB = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_conn)
+):
+    return {"code": code, "transactions": get_transactions(conn, current_user.id, code, limit)}
+
+# 获取基金历史净值数据（行格式）
+async def load_fund_history(code, days=HISTORY_DAYS, start=None, end=None, limit=None):
     try:
-        # 尝试从天天基金网获取真实的历史净值数据
-        import requests
+        # 优先读取本地存储的历史净值，必要时增量同步
         history_data = []
-        fund_info = get_fund_estimate(code)
-        
-        # 构造天天基金网历史数据API URL
-        # 注意：天天基金网的API可能会有变化，这里使用一个常见的接口格式
-        url = f"http://api.fund.eastmoney.com/f10/lsjz?fundCode={code}&pageIndex=1&pageSize=31&startDate=&endDate=&_=1633048567890"
-        
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36",
-            "Referer": f"http://fund.eastmoney.com/{code}.html"
-        }
+        fund_info = await run_in_threadpool(get_fund_estimate, code)
+        navs = await run_in_threadpool(get_nav_history, code, days, start, end, limit)
         
-        response = requests.get(url, headers=headers, timeout=10)
-        data = response.json()
-        
-        # 检查响应数据是否有效
-        if data and "Data" in data and "LSJZList" in data["Data"]:
-            lsjz_list = data["Data"]["LSJZList"]
-            
-            # 处理历史数据
-            for item in lsjz_list:
-                date = item.get("FSRQ", "")  # 日期
-                nav = item.get("DWJZ", "0")  # 单位净值
-                
-                # 确保日期和净值有效
-                if date and nav:
-                    try:
-                        nav_value = float(nav)
-                        
-                        # 生成开盘价、收盘价、最高价、最低价（基于单位净值）
-                        import random
-                        open_price = nav_value * (1 + (random.random() - 0.5) * 0.01)
-                        close_price = nav_value
-                        high_price = max(open_price, close_price) * (1 + random.random() * 0.01)
-                        low_price = min(open_price, close_price) * (1 - random.random() * 0.01)
-                        
-                        history_data.append({
-                            "date": date,
-                            "open": round(open_price, 4),
-                            "close": round(close_price, 4),
-                            "high": round(high_price, 4),
-                            "low": round(low_price, 4),
-                            "price": round(nav_value, 4)
-                        })
-                    except ValueError:
-                        pass
+        if navs:
+            # 以前一日净值作为开盘价，生成开盘价、收盘价、最高价、最低价
+            previous = navs[0][1]
+            for date, nav_value in navs:
+                history_data.append({
+                    "date": date,
+                    "open": round(previous, 4),
+                    "close": round(nav_value, 4),
+                    "high": round(max(previous, nav_value), 4),
+                    "low": round(min(previous, nav_value), 4),
+                    "price": round(nav_value, 4)
+                })
+                previous = nav_value
             
-            # 如果获取到了真实数据，返回真实数据
-            if history_data:
-                return {
-                    "code": code,
-                    "name": fund_info["name"],
-                    "history": history_data
-                }
+            return {
+                "code": code,
+                "name": fund_info["name"],
+                "history": history_data
+            }
         
         # 如果没有获取到真实数据，使用模拟数据
         # 生成模拟的历史净值数据
@@ -259,23 +353,71 @@ async def get_fund_history(code: str):
             "history": generate_mock_history_data(code)
         }
 
-# API端点：搜索基金
+# API端点：获取基金历史净值数据
+@router.get("/funds/{code}/history")
+async def get_fund_history(
+    code: str,
+    request: Request,
+    params: SeriesParams = Depends(),
+    days: int = Query(HISTORY_DAYS, ge=1, le=3650, description="返回的历史净值天数"),
+    interval: Optional[str] = Query(None, pattern=DAILY_INTERVAL_PATTERN, description="聚合周期：1w、1M")
+):
+    # 交易日不多于自然日，按起始日期到今天的自然日数加载即可覆盖整个范围
+    # 只指定结束日期时返回截至该日期的 days 条，需要同步到结束日期之前 days 天
+    limit = None
+    if params.start or params.end:
+        field, value = ("from", params.start) if params.start else ("to", params.end)
+        try:
+            since = (datetime.date.today() - datetime.date.fromisoformat(value[:10])).days + (1 if params.start else days)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{field} 参数格式应为 YYYY-MM-DD")
+        if not params.start:
+            limit = days
+        days = min(max(days, since), 3650)
+    data = await load_fund_history(code, days, params.start, params.end, limit)
+    history = data["history"]
+    last = history[-1] if history else {}
+    headers = cache_headers(
+        make_etag(request_key(request), data["name"], len(history), history[0]["date"] if history else None, last),
+        FUND_HISTORY_MAX_AGE, last.get("date")
+    )
+    cached = not_modified(request, headers)
+    if cached:
+        return cached
+    meta = {"code": data["code"], "name": data["name"]}
+    response = build_series_response(
+        history, meta, "history", "date", OHLC_FIELDS, "close", params,
+        interval=interval, series_key=("fund", code)
+    )
+    response.headers.update(headers)
+    return response
+
+# API端点：搜索基金，先返回匹配的持仓，再返回本地基金列表中的匹配项
 @router.get("/funds/search")
-async def search_funds(keyword: str = Query(..., description="搜索关键词"), current_user: UserInDB = Depends(get_current_user)):
-    conn = get_db()
+async def search_funds(
+    keyword: Optional[str] = Query(None, description="搜索关键词：基金代码、名称或拼音缩写"),
+    query: Optional[str] = Query(None, description="keyword 的别名"),
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=100, description="基金列表中匹配项的最大条数"),
+    current_user: UserInDB = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_conn)
+):
+    keyword = (keyword or query or "").strip()
+    if not keyword:
+        raise HTTPException(status_code=400, detail="请输入搜索关键词")
+    
     cursor = conn.cursor()
     cursor.execute("SELECT code, name, amount FROM funds WHERE user_id = ? AND (code LIKE ? OR name LIKE ?)", 
                   (current_user.id, f"%{keyword}%", f"%{keyword}%"))
     existing_funds = cursor.fetchall()
-    conn.close()
     
-    # 获取每个基金的实时净值预估
+    # 并发获取每个基金的实时净值预估
+    estimates = await get_fund_estimates_async([fund[0] for fund in existing_funds])
     result = []
     existing_codes = set()
     
     # 处理已存在的基金
     for fund in existing_funds:
-        estimate_data = get_fund_estimate(fund[0])
+        estimate_data = estimates[fund[0]]
         result.append({
             "code": fund[0],
             "name": fund[1],
@@ -289,31 +431,71 @@ async def search_funds(keyword: str = Query(..., description="搜索关键词"),
         })
         existing_codes.add(fund[0])
     
-    # 尝试搜索非存在的基金（如果关键词看起来像基金代码）
-    if keyword.isdigit() and len(keyword) >= 4:
-        # 检查该代码是否已在结果中
-        if keyword not in existing_codes:
-            estimate_data = get_fund_estimate(keyword)
-            # 即使是未知基金也返回，让前端处理
-            result.append({
-                "code": estimate_data["code"],
-                "name": estimate_data["name"],
-                "amount": 0,
-                "estimate": estimate_data["estimate"],
-                "estimate_change": estimate_data["estimate_change"],
-                "time": estimate_data["time"],
-                "type": estimate_data["type"],
-                "sector": estimate_data["sector"],
-                "exists": False
-            })
+    # 本地基金列表中的匹配项，估算数据只读取缓存
+    for fund in search_fund_master(conn, keyword, limit):
+        if fund["code"] in existing_codes:
+            continue
+        estimate_data = estimate_cache.peek(fund["code"]) or {}
+        # 类型和板块与持仓、持仓分布一样取自分类索引
+        classification = get_fund_type_and_sector(fund["code"])
+        result.append({
+            "code": fund["code"],
+            "name": fund["name"],
+            "amount": 0,
+            "estimate": estimate_data.get("estimate", "-"),
+            "estimate_change": estimate_data.get("estimate_change", "-"),
+            "time": estimate_data.get("time", ""),
+            "type": classification["type"],
+            "sector": classification["sector"],
+            "manager": fund["manager"],
+            "exists": False
+        })
+        existing_codes.add(fund["code"])
+    
+    # 完整的基金代码在本地列表中不存在时（如新发基金），再实时查询一次
+    if len(keyword) == 6 and keyword.isdigit() and keyword not in existing_codes:
+        estimate_data = await run_in_threadpool(get_fund_estimate, keyword)
+        result.append({
+            "code": estimate_data["code"],
+            "name": estimate_data["name"],
+            "amount": 0,
+            "estimate": estimate_data["estimate"],
+            "estimate_change": estimate_data["estimate_change"],
+            "time": estimate_data["time"],
+            "type": estimate_data["type"],
+            "sector": estimate_data["sector"],
+            "exists": False
+        })
     
     return result
 
+# API端点：预估净值缓存、后台刷新、历史净值同步、失败退避及熔断器统计
+@router.get("/funds/estimates/stats")
+async def get_estimate_cache_stats():
+    return {
+        "cache": estimate_cache.stats(),
+        "refresher": estimate_refresher.stats(),
+        "hot_funds": hot_fund_board.stats(),
+        "history": history_syncer.stats(),
+        "backoff": estimate_backoff.stats(),
+        "breakers": breaker_stats()
+    }
+
 # API端点：根据基金代码获取基金信息
 @router.get("/funds/info/{code}")
-async def get_fund_info(code: str):
+async def get_fund_info(code: str, request: Request, response: Response):
     # 获取基金信息
-    estimate_data = get_fund_estimate(code)
+    estimate_data = await run_in_threadpool(get_fund_estimate, code)
+    stale = estimate_data.get("stale", False)
+    # 缓存时间与预估净值缓存一致，交易时段内较短，收盘后到下一个交易时段开盘；过期数据每次都需要验证
+    headers = cache_headers(
+        make_etag(code, estimate_data["estimate"], estimate_data["estimate_change"], estimate_data["time"], estimate_data["name"], stale),
+        0 if stale else int(estimate_ttl()), estimate_data["time"]
+    )
+    cached = not_modified(request, headers)
+    if cached:
+        return cached
+    response.headers.update(headers)
     return {
         "code": estimate_data["code"],
         "name": estimate_data["name"],
@@ -321,267 +503,58 @@ async def get_fund_info(code: str):
         "estimate_change": estimate_data["estimate_change"],
         "time": estimate_data["time"],
         "type": estimate_data["type"],
-        "sector": estimate_data["sector"]
+        "sector": estimate_data["sector"],
+        "stale": stale
     }
 
 # API端点：导出基金数据
 @router.get("/funds/export")
-async def export_funds(current_user: UserInDB = Depends(get_current_user)):
-    try:
-        print(f"导出基金：用户ID={current_user.id}, 用户名={current_user.username}")
-        
-        # 连接数据库
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # 查询基金数据
-        cursor.execute("SELECT code, name FROM funds WHERE user_id = ?", (current_user.id,))
-        funds = cursor.fetchall()
-        conn.close()
-        
-        print(f"找到基金数量：{len(funds)}")
-        
-        # 构建CSV格式数据
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["基金代码", "基金名称"])
-        for fund in funds:
-            writer.writerow(fund)
-        
-        csv_content = output.getvalue()
-        print(f"CSV内容长度：{len(csv_content)}")
-        
-        # 返回CSV文件
-        return Response(
-            content=csv_content,
-            media_type="text/csv",
-            headers={
-                "Content-Disposition": f"attachment; filename=funds_{current_user.username}.csv"
-            }
-        )
-    except Exception as e:
-        print(f"导出失败：{str(e)}")
-        raise HTTPException(status_code=500, detail=f"导出失败：{str(e)}")
+async def export_funds(
+    format: str = Query("csv", pattern=EXPORT_FORMAT_PATTERN, description="导出格式：csv、xlsx、parquet"),
+    dataset: str = Query("holdings", pattern=EXPORT_DATASET_PATTERN, description="导出内容：holdings、transactions、all"),
+    estimates: bool = Query(True, description="持仓是否包含缓存中的估算净值和市值"),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    error = check_export(format, dataset)
+    if error:
+        raise HTTPException(status_code=error[0], detail=error[1])
+    
+    # 边读取边发送，内存占用与持仓和交易数量无关
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"funds_{current_user.username}.{extension}"
+    return StreamingResponse(
+        export_stream(current_user.id, format, dataset, estimates),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename=funds.{extension}; filename*=UTF-8''{quote(filename)}"
+        }
+    )
 
 # API端点：获取单个基金详情
 @router.get("/fund")
-async def get_fund(code: str = Query(..., description="基金代码"), current_user: UserInDB = Depends(get_current_user)):
-    conn = get_db()
+async def get_fund(code: str = Query(..., description="基金代码"), current_user: UserInDB = Depends(get_current_user), conn: sqlite3.Connection = Depends(get_conn)):
     cursor = conn.cursor()
     cursor.execute("SELECT code, name, amount, shares FROM funds WHERE user_id = ? AND code = ?", (current_user.id, code))
     fund = cursor.fetchone()
-    conn.close()
     
     if not fund:
         raise HTTPException(status_code=404, detail="基金不存在")
     
     # 获取实时净值预估
-    estimate_data = get_fund_estimate(code)
-    # 计算当前市值
-    nav = float(estimate_data["estimate"]) if estimate_data["estimate"] != "-" else 1.0
-    # 正确的计算应该是使用份额乘以当前净值
-    shares = fund[3] if len(fund) > 3 else 0
-    current_value = shares * nav if shares > 0 else 0
-    return {
-        "code": fund[0],
-        "name": fund[1],
-        "amount": fund[2],
-        "shares": fund[3] if len(fund) > 3 else 0,
-        "estimate": estimate_data["estimate"],
-        "estimate_change": estimate_data["estimate_change"],
-        "time": estimate_data["time"],
-        "type": estimate_data["type"],
-        "sector": estimate_data["sector"],
-        "current_value": current_value
-    }
+    return build_holding(fund, await run_in_threadpool(get_fund_estimate, code))
 
-# API端点：获取全部基金信息
+# API端点：获取全部基金信息（热门基金榜单），返回后台生成的快照，支持 If-None-Match
 @router.get("/funds/all")
-async def get_all_funds():
-    # 热门基金列表，包含更多基金
-    hot_funds = [
-        # 华夏基金
-        {"code": "000001", "name": "华夏成长混合"},
-        {"code": "000002", "name": "华夏大盘精选混合"},
-        {"code": "000003", "name": "华夏现金增利货币"},
-        {"code": "000004", "name": "华夏回报混合A"},
-        {"code": "000005", "name": "华夏上证50ETF"},
-        {"code": "000006", "name": "华夏海外收益债券A"},
-        {"code": "000007", "name": "华夏全球股票(QDII)"},
-        {"code": "000008", "name": "华夏稳增混合"},
-        {"code": "000009", "name": "华夏兴华混合"},
-        {"code": "000010", "name": "华夏策略混合"},
-        
-        # 易方达基金
-        {"code": "110001", "name": "易方达平稳增长混合"},
-        {"code": "110002", "name": "易方达策略成长混合"},
-        {"code": "110003", "name": "易方达50指数"},
-        {"code": "110005", "name": "易方达积极成长混合"},
-        {"code": "110006", "name": "易方达货币A"},
-        {"code": "110007", "name": "易方达稳健收益债券A"},
-        {"code": "110008", "name": "易方达稳健收益债券B"},
-        {"code": "110009", "name": "易方达价值精选混合"},
-        {"code": "110010", "name": "易方达价值成长混合"},
-        {"code": "110011", "name": "易方达优质精选混合(QDII)"},
-        
-        # 嘉实基金
-        {"code": "070001", "name": "嘉实成长收益混合A"},
-        {"code": "070002", "name": "嘉实理财增长混合"},
-        {"code": "070003", "name": "嘉实理财稳健混合"},
-        {"code": "070005", "name": "嘉实理财债券"},
-        {"code": "070006", "name": "嘉实服务增值行业混合"},
-        {"code": "070008", "name": "嘉实货币A"},
-        {"code": "070009", "name": "嘉实超短债债券"},
-        {"code": "070010", "name": "嘉实主题精选混合"},
-        {"code": "070011", "name": "嘉实策略增长混合"},
-        {"code": "070012", "name": "嘉实海外中国股票混合(QDII)"},
-        
-        # 南方基金
-        {"code": "160201", "name": "南方稳健成长混合A"},
-        {"code": "160202", "name": "南方稳健成长贰号混合"},
-        {"code": "160204", "name": "南方稳健成长混合C"},
-        {"code": "160205", "name": "南方成份精选混合A"},
-        {"code": "160206", "name": "南方避险增值混合"},
-        {"code": "160207", "name": "南方隆元产业主题混合"},
-        {"code": "160208", "name": "南方全球精选配置(QDII-FOF)"},
-        {"code": "160209", "name": "南方盛元红利混合"},
-        {"code": "160210", "name": "南方优选价值混合A"},
-        {"code": "160211", "name": "南方优选价值混合C"},
-        
-        # 广发基金
-        {"code": "270001", "name": "广发聚富混合A"},
-        {"code": "270002", "name": "广发稳健增长混合A"},
-        {"code": "270004", "name": "广发货币A"},
-        {"code": "270005", "name": "广发聚丰混合A"},
-        {"code": "270006", "name": "广发策略优选混合"},
-        {"code": "270007", "name": "广发大盘成长混合A"},
-        {"code": "270008", "name": "广发核心精选混合A"},
-        {"code": "270009", "name": "广发增强债券A"},
-        {"code": "270010", "name": "广发沪深300ETF联接A"},
-        {"code": "270011", "name": "广发中证500ETF联接A"},
-        
-        # 汇添富基金
-        {"code": "519008", "name": "汇添富优势精选混合A"},
-        {"code": "519018", "name": "汇添富均衡增长混合A"},
-        {"code": "519068", "name": "汇添富成长焦点混合A"},
-        {"code": "519069", "name": "汇添富价值精选混合A"},
-        {"code": "519078", "name": "汇添富增强收益债券A"},
-        {"code": "519088", "name": "汇添富策略回报混合A"},
-        {"code": "519098", "name": "汇添富民营活力混合A"},
-        {"code": "519118", "name": "汇添富医疗服务混合A"},
-        {"code": "519128", "name": "汇添富消费行业混合A"},
-        {"code": "519168", "name": "汇添富环保行业股票A"},
-        
-        # 富国基金
-        {"code": "100016", "name": "富国天源平衡混合A"},
-        {"code": "100018", "name": "富国天利增长债券A"},
-        {"code": "100020", "name": "富国天益价值混合A"},
-        {"code": "100022", "name": "富国天瑞强势混合A"},
-        {"code": "100026", "name": "富国天合稳健混合A"},
-        {"code": "100028", "name": "富国天成红利混合A"},
-        {"code": "100032", "name": "富国天鼎中证红利指数增强A"},
-        {"code": "100038", "name": "富国沪深300ETF联接A"},
-        {"code": "100056", "name": "富国低碳环保混合A"},
-        {"code": "100060", "name": "富国高新技术产业混合A"},
-        
-        # 博时基金
-        {"code": "050001", "name": "博时价值增长混合A"},
-        {"code": "050002", "name": "博时裕富沪深300指数A"},
-        {"code": "050003", "name": "博时现金收益货币A"},
-        {"code": "050004", "name": "博时精选混合A"},
-        {"code": "050006", "name": "博时稳定价值债券A"},
-        {"code": "050007", "name": "博时平衡配置混合A"},
-        {"code": "050008", "name": "博时第三产业混合A"},
-        {"code": "050009", "name": "博时新兴成长混合A"},
-        {"code": "050010", "name": "博时特许价值混合A"},
-        {"code": "050011", "name": "博时信用债券A"},
-        
-        # 工银瑞信基金
-        {"code": "481001", "name": "工银瑞信核心价值混合A"},
-        {"code": "481004", "name": "工银瑞信稳健成长混合A"},
-        {"code": "481006", "name": "工银瑞信红利混合A"},
-        {"code": "481008", "name": "工银瑞信大盘蓝筹混合A"},
-        {"code": "481009", "name": "工银瑞信沪深300ETF联接A"},
-        {"code": "481010", "name": "工银瑞信中小盘成长混合A"},
-        {"code": "481012", "name": "工银瑞信消费服务混合A"},
-        {"code": "481015", "name": "工银瑞信主题策略混合A"},
-        {"code": "481017", "name": "工银瑞信基本面量化策略混合A"},
-        {"code": "481018", "name": "工银瑞信添颐债券A"},
-        
-        # 鹏华基金
-        {"code": "160607", "name": "鹏华价值优势混合(L0F)"},
-        {"code": "160608", "name": "鹏华普天债券A"},
-        {"code": "160609", "name": "鹏华普天收益混合"},
-        {"code": "160610", "name": "鹏华动力增长混合(L0F)"},
-        {"code": "160611", "name": "鹏华优质治理混合(L0F)"},
-        {"code": "160612", "name": "鹏华丰收债券"},
-        {"code": "160613", "name": "鹏华盛世创新混合(L0F)"},
-        {"code": "160615", "name": "鹏华沪深300ETF联接A"},
-        {"code": "160616", "name": "鹏华中证500指数(L0F)"},
-        {"code": "160617", "name": "鹏华丰润债券(L0F)"}
-    ]
-    
-    # 获取每个基金的实时净值预估
-    result = []
-    for fund in hot_funds:
-        try:
-            estimate_data = get_fund_estimate(fund["code"])
-            result.append({
-                "code": fund["code"],
-                "name": fund["name"],
-                "estimate": estimate_data["estimate"],
-                "estimate_change": estimate_data["estimate_change"],
-                "time": estimate_data["time"],
-                "type": estimate_data["type"],
-                "sector": estimate_data["sector"]
-            })
-        except Exception as e:
-            print(f"获取基金{fund['code']}数据失败:", e)
-            # 如果获取失败，添加一个默认数据
-            result.append({
-                "code": fund["code"],
-                "name": fund["name"],
-                "estimate": "0.00",
-                "estimate_change": "0.00",
-                "time": "",
-                "type": "混合型",
-                "sector": "未分类"
-            })
-    
-    return result
+async def get_all_funds(request: Request):
+    body, etag = hot_fund_board.snapshot()
+    headers = cache_headers(etag, 0)
+    return not_modified(request, headers) or Response(content=body, media_type="application/json", headers=headers)
 
 # API端点：导入基金数据
 @router.post("/funds/import")
-async def import_funds(file: UploadFile = File(...), current_user: UserInDB = Depends(get_current_user)):
-    import csv
-    import io
-    
+async def import_funds(file: UploadFile = File(...), current_user: UserInDB = Depends(get_current_user), conn: sqlite3.Connection = Depends(get_conn)):
     try:
-        content = await file.read()
-        content = content.decode("utf-8")
-        reader = csv.reader(io.StringIO(content))
-        next(reader)  # 跳过表头
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        added_count = 0
-        
-        for row in reader:
-            if len(row) >= 2:
-                code = row[0].strip()
-                name = row[1].strip()
-                
-                if code and name:
-                    # 检查基金是否已存在
-                    cursor.execute("SELECT id FROM funds WHERE user_id = ? AND code = ?", (current_user.id, code))
-                    existing_fund = cursor.fetchone()
-                    if not existing_fund:
-                        cursor.execute("INSERT INTO funds (user_id, code, name) VALUES (?, ?, ?)", (current_user.id, code, name))
-                        added_count += 1
-        
-        conn.commit()
-        conn.close()
-        
-        return {"message": f"导入成功，新增 {added_count} 个基金"}
+        # 上传文件已缓存在临时文件中，在线程池中逐块解码、分批写入
+        return await run_in_threadpool(import_holdings, conn, current_user.id, file.file)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"导入失败：{str(e)}")
@@ -1,27 +1,77 @@
-from fastapi import APIRouter
-from app.services.gold_service import get_gold_price, get_gold_history, get_gold_minute_data
+from typing import Optional
+from fastapi import APIRouter, Depends, Query, Request, Response
+from starlette.concurrency import run_in_threadpool
+from app.models import GoldPrice
+from app.utils.timeseries import build_series_response, SeriesParams, MINUTE_INTERVAL_PATTERN, DAILY_INTERVAL_PATTERN
+from app.utils.http_cache import make_etag, request_key, cache_headers, not_modified
+from app.services.gold_service import get_gold_price, get_gold_history, get_gold_minute_data, GOLD_QUOTE_TTL
 
 router = APIRouter()
 
+# 上海金序列以外的字段
+GOLD_META = {"code": "AU9999", "name": "上海金"}
+# 浏览器缓存时间（秒）：实时报价随报价缓存过期，分钟K线每分钟更新，日K线盘中最后一根也会变化
+GOLD_MAX_AGE = GOLD_QUOTE_TTL
+GOLD_MINUTE_MAX_AGE = 60
+GOLD_HISTORY_MAX_AGE = 300
+
 # API端点：获取上海金实时数据
-@router.get("/gold")
-async def get_gold():
-    return get_gold_price()
+@router.get("/gold", response_model=GoldPrice)
+async def get_gold(request: Request, response: Response):
+    quote = await run_in_threadpool(get_gold_price)
+    # age、cached 每次请求都不同，不参与 ETag
+    etag = make_etag(quote["price"], quote["change"], quote["time"], quote["source"], quote.get("fetched_at"), quote.get("stale"))
+    headers = cache_headers(etag, GOLD_MAX_AGE, quote.get("fetched_at"))
+    cached = not_modified(request, headers)
+    if cached:
+        return cached
+    response.headers.update(headers)
+    return quote
 
 # API端点：获取上海金历史数据
 @router.get("/gold/history")
-async def get_gold_history_data():
-    return {
-        "code": "AU9999",
-        "name": "上海金",
-        "history": get_gold_history()
-    }
+async def get_gold_history_data(
+    request: Request,
+    params: SeriesParams = Depends(),
+    days: int = Query(31, ge=1, le=3650, description="未指定起始时间时返回的天数"),
+    interval: Optional[str] = Query(None, pattern=DAILY_INTERVAL_PATTERN, description="聚合周期：1w、1M")
+):
+    history = await run_in_threadpool(get_gold_history, days, params.start, params.end)
+    last = history[-1] if history else {}
+    headers = cache_headers(
+        make_etag(request_key(request), len(history), history[0]["date"] if history else None, last),
+        GOLD_HISTORY_MAX_AGE, last.get("date")
+    )
+    cached = not_modified(request, headers)
+    if cached:
+        return cached
+    response = build_series_response(
+        history, GOLD_META, "history", "date", ("open", "close", "high", "low", "price"), "close", params,
+        interval=interval, series_key=("gold", "1d")
+    )
+    response.headers.update(headers)
+    return response
 
 # API端点：获取上海金分时数据
 @router.get("/gold/minute")
-async def get_gold_minute_data_endpoint():
-    return {
-        "code": "AU9999",
-        "name": "上海金",
-        "minute_data": get_gold_minute_data()
-    }
+async def get_gold_minute_data_endpoint(
+    request: Request,
+    params: SeriesParams = Depends(),
+    limit: int = Query(1000, ge=1, le=20000, description="未指定起始时间时返回的分钟数"),
+    interval: Optional[str] = Query(None, pattern=MINUTE_INTERVAL_PATTERN, description="聚合周期：5m、15m、1h")
+):
+    minute_data = await run_in_threadpool(get_gold_minute_data, limit, params.start, params.end)
+    last = minute_data[-1] if minute_data else {}
+    headers = cache_headers(
+        make_etag(request_key(request), len(minute_data), minute_data[0]["time"] if minute_data else None, last),
+        GOLD_MINUTE_MAX_AGE, last.get("time")
+    )
+    cached = not_modified(request, headers)
+    if cached:
+        return cached
+    response = build_series_response(
+        minute_data, GOLD_META, "minute_data", "time", ("price",), "price", params,
+        interval=interval, series_key=("gold", "1m"), display_label=lambda ts: ts[11:16]
+    )
+    response.headers.update(headers)
+    return response
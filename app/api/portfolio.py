@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends, Query, Request, Response
+from starlette.concurrency import run_in_threadpool
+import sqlite3
+from app.database import get_conn
+from app.api.auth import get_current_user, UserInDB
+from app.utils.http_cache import make_etag, cache_headers, not_modified
+from app.services.portfolio_service import get_portfolio_analytics, get_portfolio_breakdown, ANALYTICS_DAYS
+
+router = APIRouter(tags=["portfolio"])
+
+# 按用户区分的结果，每次都需要向服务器验证，未变化时返回 304
+def with_cache_headers(request, response, user_id, result):
+    headers = cache_headers(make_etag(user_id, result), 0, private=True)
+    cached = not_modified(request, headers)
+    if cached:
+        return cached
+    response.headers.update(headers)
+    return result
+
+# API端点：组合分析（每日盈亏、累计收益、最大回撤、波动率、夏普比率、相关系数矩阵）
+@router.get("/portfolio/analytics")
+async def portfolio_analytics(
+    request: Request,
+    response: Response,
+    days: int = Query(ANALYTICS_DAYS, ge=2, le=3650, description="参与计算的交易日数量"),
+    current_user: UserInDB = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_conn)
+):
+    result = await run_in_threadpool(get_portfolio_analytics, conn, current_user.id, days)
+    return with_cache_headers(request, response, current_user.id, result)
+
+# API端点：按类型、板块、基金公司汇总持仓（市值、权重、今日估算盈亏）
+@router.get("/portfolio/breakdown")
+async def portfolio_breakdown(
+    request: Request,
+    response: Response,
+    current_user: UserInDB = Depends(get_current_user),
+    conn: sqlite3.Connection = Depends(get_conn)
+):
+    result = await run_in_threadpool(get_portfolio_breakdown, conn, current_user.id)
+    return with_cache_headers(request, response, current_user.id, result)
@@ -1,58 +1,119 @@
 import sqlite3
+import queue
 from pathlib import Path
 
 # 数据库文件
 DATABASE = "funds.db"
+# 连接池保留的空闲连接数，超出时临时创建的连接用完即关闭
+POOL_SIZE = 8
+# 等待其他连接释放写锁的最长时间（秒）
+BUSY_TIMEOUT = 5
+# 每个连接缓存的预编译语句数量
+STATEMENT_CACHE_SIZE = 256
+# 连接初始化时设置的参数
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+)
 
-# 初始化数据库
+# 连接池中的连接，close() 时归还连接池而不是真正关闭
+class PooledConnection(sqlite3.Connection):
+    pool = None
+    in_use = False
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        elif self.in_use:
+            self.pool.release(self)
+
+    def dispose(self):
+        self.pool = None
+        super().close()
+
+class ConnectionPool:
+    """
+    SQLite 连接池
+    连接开启 WAL 模式，读写互不阻塞；连接复用时预编译语句缓存也随之复用
+    空闲连接不足时临时创建新连接，获取连接永远不会阻塞
+    """
+
+    def __init__(self, database=DATABASE, size=POOL_SIZE):
+        self.database = database
+        self.size = size
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            factory=PooledConnection,
+            timeout=BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        conn.in_use = True
+        return conn
+
+    def release(self, conn):
+        conn.in_use = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.dispose()
+            return
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.dispose()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().dispose()
+            except queue.Empty:
+                break
+
+# 全局连接池
+pool = ConnectionPool()
+
+# 初始化数据库：执行尚未执行的结构迁移
 def init_db():
+    from app.database.migrations import migrate
     conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    # 创建用户表
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL
-    )
-    ''')
-    
-    # 创建基金表
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS funds (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        code TEXT NOT NULL,
-        name TEXT NOT NULL,
-        amount REAL DEFAULT 0,
-        shares REAL DEFAULT 0,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
-    
-    # 创建历史净值表
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS fund_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        code TEXT NOT NULL,
-        date TEXT NOT NULL,
-        nav REAL NOT NULL,
-        change_rate REAL DEFAULT 0,
-        UNIQUE(code, date)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-# 获取数据库连接
+    try:
+        for migration in migrate(conn):
+            print(f"数据库迁移 {migration.version}: {migration.description}")
+    finally:
+        conn.close()
+
+# 获取数据库连接（从连接池中取出，close() 时归还）
 def get_db():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return pool.acquire()
 
 # 关闭数据库连接
 def close_db(conn):
     if conn:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+# FastAPI 依赖：每个请求使用一个连接，请求结束后归还连接池
+def get_conn():
+    conn = get_db()
+    try:
+        yield conn
+    finally:
+        close_db(conn)
@@ -0,0 +1,276 @@
+import sqlite3
+
+class Migration:
+    """
+    一次数据库结构变更
+    version: 版本号，执行后写入 PRAGMA user_version
+    statements: 按顺序执行的 SQL，也可以是接收连接的函数
+    plans: 本次变更需要保证走索引的查询，由 check_query_plans 检查
+    """
+
+    def __init__(self, version, description, statements, plans=()):
+        self.version = version
+        self.description = description
+        self.statements = statements
+        self.plans = plans
+
+# 旧数据库可能缺少的列
+def _add_missing_columns(conn):
+    columns = {
+        "funds": [("amount", "REAL DEFAULT 0"), ("shares", "REAL DEFAULT 0")],
+        "fund_history": [("source", "TEXT NOT NULL DEFAULT 'mock'")],
+    }
+    for table, wanted in columns.items():
+        existing = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        for name, definition in wanted:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+# 建立唯一索引前合并重复的持仓：金额和份额累加到最早添加的一条，再删除其余的
+def _dedupe_funds(conn):
+    conn.execute("""
+    UPDATE funds SET
+        amount = (SELECT SUM(COALESCE(d.amount, 0)) FROM funds d WHERE d.user_id = funds.user_id AND d.code = funds.code),
+        shares = (SELECT SUM(COALESCE(d.shares, 0)) FROM funds d WHERE d.user_id = funds.user_id AND d.code = funds.code)
+    WHERE id IN (
+        SELECT MIN(id) FROM funds GROUP BY user_id, code HAVING COUNT(*) > 1
+    )
+    """)
+    conn.execute("""
+    DELETE FROM funds WHERE id NOT IN (
+        SELECT MIN(id) FROM funds GROUP BY user_id, code
+    )
+    """)
+
+# 为已有持仓写入一条期初买入记录，使交易流水与持仓汇总一致
+# 只有金额或只有份额的持仓无法确定成交净值，不写入净值为 0 的记录（交易流水只能追加，写入后无法更正）
+def _open_ledger(conn):
+    conn.execute("""
+    INSERT INTO transactions (user_id, code, side, shares, nav, amount, created_at)
+    SELECT user_id, code, 'buy', shares, amount / shares, amount,
+           strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')
+    FROM funds WHERE shares > 0 AND amount > 0
+    """)
+
+# 按基金名称为已有分类补充基金公司，保留已有的分类（包括 F10 校正过的）
+def _backfill_company(conn):
+    # 在函数内导入，避免数据库模块在加载时依赖服务层
+    from app.services.fund_classification import extract_company
+    rows = conn.execute(
+        "SELECT c.code, m.name FROM fund_classification c JOIN fund_master m ON m.code = c.code"
+    ).fetchall()
+    conn.executemany(
+        "UPDATE fund_classification SET company = ? WHERE code = ?",
+        [(extract_company(name), code) for code, name in rows]
+    )
+
+MIGRATIONS = [
+    Migration(1, "基础表结构", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS funds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            name TEXT NOT NULL,
+            amount REAL DEFAULT 0,
+            shares REAL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS fund_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT NOT NULL,
+            date TEXT NOT NULL,
+            nav REAL NOT NULL,
+            change_rate REAL DEFAULT 0,
+            source TEXT NOT NULL DEFAULT 'mock',
+            UNIQUE(code, date)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS fund_history_sync (
+            code TEXT PRIMARY KEY,
+            synced_at TEXT NOT NULL,
+            exhausted INTEGER DEFAULT 0
+        )
+        """,
+        _add_missing_columns,
+    ], plans=[
+        ("SELECT id, username, password FROM users WHERE username = ?", ("u",)),
+    ]),
+    Migration(2, "持仓表 (user_id, code) 唯一约束", [
+        _dedupe_funds,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_funds_user_code ON funds (user_id, code)",
+    ], plans=[
+        ("SELECT id FROM funds WHERE user_id = ? AND code = ?", (1, "000001")),
+        ("SELECT amount, shares FROM funds WHERE user_id = ? AND code = ?", (1, "000001")),
+        ("DELETE FROM funds WHERE user_id = ? AND code = ?", (1, "000001")),
+        ("SELECT code, name FROM funds WHERE user_id = ? AND (code LIKE ? OR name LIKE ?)", (1, "%0%", "%0%")),
+    ]),
+    Migration(3, "持仓列表覆盖索引及基金代码索引", [
+        "CREATE INDEX IF NOT EXISTS idx_funds_user_listing ON funds (user_id, code, name, amount, shares)",
+        "CREATE INDEX IF NOT EXISTS idx_funds_code ON funds (code)",
+    ], plans=[
+        ("SELECT code, name, amount, shares FROM funds WHERE user_id = ?", (1,)),
+        ("SELECT code, name FROM funds WHERE user_id = ?", (1,)),
+        ("SELECT DISTINCT code FROM funds", ()),
+    ]),
+    Migration(4, "历史净值按来源和日期的覆盖索引", [
+        "CREATE INDEX IF NOT EXISTS idx_fund_history_source_date ON fund_history (code, source, date, nav)",
+    ], plans=[
+        ("SELECT nav FROM fund_history WHERE code = ? ORDER BY date DESC LIMIT 1", ("000001",)),
+        ("SELECT date, nav FROM fund_history WHERE code = ? AND source = 'lsjz' AND date >= ? AND date <= ? ORDER BY date DESC LIMIT ?",
+         ("000001", "", "9999~", 31)),
+        ("SELECT MIN(date), MAX(date), COUNT(*) FROM fund_history WHERE code = ? AND source = 'lsjz'", ("000001",)),
+        ("SELECT MAX(date) FROM fund_history WHERE code IN (?, ?) AND source = 'lsjz'", ("000001", "110011")),
+        ("SELECT code, date, nav FROM fund_history WHERE code IN (?, ?) AND source = 'lsjz' ORDER BY code, date", ("000001", "110011")),
+    ]),
+    Migration(5, "上海金K线存储", [
+        """
+        CREATE TABLE IF NOT EXISTS gold_kline (
+            code TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            open REAL NOT NULL,
+            close REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            volume REAL DEFAULT 0,
+            PRIMARY KEY (code, resolution, ts)
+        ) WITHOUT ROWID
+        """,
+    ], plans=[
+        ("SELECT ts, open, close, high, low FROM gold_kline WHERE code = ? AND resolution = ? ORDER BY ts DESC LIMIT ?", ("AU9999", "1m", 1000)),
+        ("SELECT MAX(ts) FROM gold_kline WHERE code = ? AND resolution = ?", ("AU9999", "1m")),
+        ("SELECT ts, open, close, high, low FROM gold_kline WHERE code = ? AND resolution = ? AND ts >= ? AND ts <= ? ORDER BY ts DESC LIMIT ?",
+         ("AU9999", "1d", "2024-01-01", "2024-12-31~", -1)),
+    ]),
+    Migration(6, "交易流水及持仓已实现盈亏", [
+        """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            side TEXT NOT NULL CHECK (side IN ('buy', 'sell')),
+            shares REAL NOT NULL,
+            nav REAL NOT NULL,
+            amount REAL NOT NULL,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_code ON transactions (user_id, code, id)",
+        # 交易流水只允许追加
+        """
+        CREATE TRIGGER IF NOT EXISTS transactions_no_update BEFORE UPDATE ON transactions
+        BEGIN SELECT RAISE(ABORT, 'transactions are append-only'); END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS transactions_no_delete BEFORE DELETE ON transactions
+        BEGIN SELECT RAISE(ABORT, 'transactions are append-only'); END
+        """,
+        "ALTER TABLE funds ADD COLUMN realized_pnl REAL DEFAULT 0",
+        _open_ledger,
+    ], plans=[
+        ("SELECT amount, shares, realized_pnl FROM funds WHERE user_id = ? AND code = ?", (1, "000001")),
+        ("SELECT id, side, shares, nav, amount, realized_pnl, created_at FROM transactions WHERE user_id = ? AND code = ? ORDER BY id DESC LIMIT ?",
+         (1, "000001", 100)),
+        ("SELECT id, code, side, shares, nav, amount, realized_pnl, created_at FROM transactions WHERE user_id = ? ORDER BY code, id", (1,)),
+    ]),
+    Migration(7, "基金基础信息表及全文索引", [
+        """
+        CREATE TABLE IF NOT EXISTS fund_master (
+            code TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            abbr TEXT NOT NULL DEFAULT '',
+            pinyin TEXT NOT NULL DEFAULT '',
+            type TEXT NOT NULL DEFAULT '',
+            manager TEXT NOT NULL DEFAULT '',
+            updated_at TEXT NOT NULL
+        )
+        """,
+        # trigram 分词支持任意位置的子串匹配，索引内容从 fund_master 读取
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS fund_master_fts USING fts5(
+            code, name, abbr, pinyin, content='fund_master', tokenize='trigram'
+        )
+        """,
+    ], plans=[
+        ("SELECT code, name, type, manager FROM fund_master WHERE code >= ? AND code < ? ORDER BY code LIMIT ?", ("1100", "1100:", 20)),
+        ("SELECT m.code, m.name, m.abbr, m.type, m.manager FROM fund_master_fts f JOIN fund_master m ON m.rowid = f.rowid "
+         "WHERE fund_master_fts MATCH ? ORDER BY f.rank LIMIT ?", ('"易方达"', 200)),
+    ]),
+    Migration(8, "基金分类表", [
+        """
+        CREATE TABLE IF NOT EXISTS fund_classification (
+            code TEXT PRIMARY KEY,
+            type TEXT NOT NULL DEFAULT '',
+            sector TEXT NOT NULL DEFAULT '',
+            tracked_index TEXT NOT NULL DEFAULT '',
+            source TEXT NOT NULL DEFAULT 'rule',
+            updated_at TEXT NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ], plans=[
+        ("SELECT type, sector, tracked_index FROM fund_classification WHERE code = ?", ("000001",)),
+        ("SELECT code, name FROM fund_master WHERE code IN (?, ?)", ("000001", "110011")),
+    ]),
+    Migration(9, "基金分类增加基金公司", [
+        "ALTER TABLE fund_classification ADD COLUMN company TEXT NOT NULL DEFAULT ''",
+        _backfill_company,
+    ], plans=[
+        ("SELECT f.code, f.name, f.amount, f.shares, c.type, c.sector, c.company FROM funds f "
+         "LEFT JOIN fund_classification c ON c.code = f.code WHERE f.user_id = ? ORDER BY f.code", (1,)),
+    ]),
+]
+
+# 当前数据库版本
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# 依次执行尚未执行的迁移，返回本次执行的迁移
+def migrate(conn, migrations=MIGRATIONS):
+    applied = []
+    current = get_version(conn)
+    for migration in sorted(migrations, key=lambda m: m.version):
+        if migration.version <= current:
+            continue
+        try:
+            conn.execute("BEGIN")
+            for statement in migration.statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(migration)
+        current = migration.version
+    return applied
+
+# 查询计划中的全表扫描（SCAN 且未使用索引）
+def find_full_scans(conn, sql, params=()):
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [row[3] for row in plan if row[3].startswith("SCAN") and "INDEX" not in row[3]]
+
+# 检查所有迁移声明的查询都走索引，返回 [(版本, SQL, 全表扫描明细)]
+def check_query_plans(conn, migrations=MIGRATIONS):
+    failures = []
+    for migration in migrations:
+        for sql, params in migration.plans:
+            scans = find_full_scans(conn, sql, params)
+            if scans:
+                failures.append((migration.version, sql, scans))
+    return failures
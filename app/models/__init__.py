@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Literal
 
 # 用户模型
 class User(BaseModel):
@@ -17,21 +17,33 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
 
-# 基金模型
+# 基金模型，amount 大于 0 时按 nav 记录首笔买入，nav 为空时使用当前估算净值
 class Fund(BaseModel):
     code: str
     name: str
     amount: float = 0
+    nav: Optional[float] = None
 
 class FundInDB(Fund):
     id: int
     user_id: int
     shares: float = 0
 
-# 基金金额更新模型
+# 基金金额更新模型，sell_all 为真时卖出全部持有份额并忽略 amount；nav 为空时使用当前估算净值
 class FundAmountUpdate(BaseModel):
-    amount: float
+    amount: float = 0
     sell: bool = False
+    sell_all: bool = False
+    nav: Optional[float] = None
+
+# 交易模型：amount 为成交金额，shares 为成交份额，二选一；nav 为空时使用当前估算净值
+class Trade(BaseModel):
+    code: str
+    side: Literal["buy", "sell"]
+    amount: Optional[float] = None
+    shares: Optional[float] = None
+    nav: Optional[float] = None
+    name: Optional[str] = None
 
 # 上海金模型
 class GoldPrice(BaseModel):
@@ -41,6 +53,10 @@ class GoldPrice(BaseModel):
     name: str
     code: str
     source: str
+    fetched_at: Optional[str] = None
+    age: Optional[float] = None
+    cached: bool = False
+    stale: bool = False
 
 # 黄金历史数据模型
 class GoldHistoryItem(BaseModel):
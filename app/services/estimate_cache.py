@@ -0,0 +1,192 @@
+import time
+import threading
+from collections import OrderedDict
+from app.utils.market import seconds_until_next_session
+
+# 交易时段内预估净值的缓存时间（秒），天天基金的 gsz 每隔几分钟才更新一次
+ESTIMATE_TTL_TRADING = 60
+# 非交易时段的缓存时间（秒），到下一个交易时段开盘时提前失效
+ESTIMATE_TTL_CLOSED = 30 * 60
+# 降级数据（上次的估值或模拟数据）的最长缓存时间（秒），上游恢复后尽快换回实时数据
+ESTIMATE_TTL_STALE = 30
+# 缓存的最大基金数量
+ESTIMATE_CACHE_SIZE = 4096
+# 基金查询失败后的首次退避时间（秒），连续失败时加倍
+BACKOFF_BASE = 30
+# 最长退避时间（秒）
+BACKOFF_MAX = 3600
+
+# 根据交易时段计算缓存时间
+def estimate_ttl():
+    wait = seconds_until_next_session()
+    if wait <= 0:
+        return ESTIMATE_TTL_TRADING
+    return max(1, min(ESTIMATE_TTL_CLOSED, wait))
+
+# 正在进行中的上游请求，同一基金的并发请求共享同一个结果
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+class EstimateCache:
+    """
+    按基金代码缓存实时净值预估
+    1. 过期时间随交易时段变化
+    2. 超出容量时淘汰最久未使用的基金
+    3. 同一基金同时只会有一个上游请求，其余请求等待该请求的结果
+    4. 降级数据最多缓存 ESTIMATE_TTL_STALE 秒
+    """
+
+    def __init__(self, maxsize=ESTIMATE_CACHE_SIZE, ttl=estimate_ttl):
+        self.maxsize = maxsize
+        self._ttl = ttl
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get_fresh(self, code):
+        """只读缓存，未命中或已过期时返回 None，由调用方自行请求上游"""
+        with self._lock:
+            value = self._lookup(code)
+            if value is None:
+                self.misses += 1
+            return value
+
+    def _lookup(self, code):
+        entry = self._data.get(code)
+        if entry and entry[0] > time.monotonic():
+            self._data.move_to_end(code)
+            self.hits += 1
+            return dict(entry[1])
+        return None
+
+    def get(self, code, loader, count_miss=True):
+        """count_miss 为 False 时不计入未命中次数，用于已经通过 get_fresh 记录过未命中的请求"""
+        with self._lock:
+            value = self._lookup(code)
+            if value is not None:
+                return value
+            flight = self._inflight.get(code)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[code] = _Flight()
+                if count_miss:
+                    self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return dict(flight.value)
+
+        try:
+            flight.value = loader(code)
+            self.put(code, flight.value)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(code, None)
+            flight.event.set()
+        return dict(flight.value)
+
+    def put(self, code, value, ttl=None):
+        if ttl is None:
+            ttl = self._ttl()
+        if value.get("stale"):
+            ttl = min(ttl, ESTIMATE_TTL_STALE)
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            self._data[code] = (expires_at, value)
+            self._data.move_to_end(code)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def peek(self, code):
+        with self._lock:
+            entry = self._data.get(code)
+            return dict(entry[1]) if entry else None
+
+    def invalidate(self, code=None):
+        with self._lock:
+            if code is None:
+                self._data.clear()
+            else:
+                self._data.pop(code, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+                "ttl": self._ttl(),
+            }
+
+# 全局共享的预估净值缓存
+estimate_cache = EstimateCache()
+
+class FailureBackoff:
+    """
+    按基金代码记录上游查询失败（负缓存）
+    连续失败时退避时间指数增长，退避期间不再请求上游，成功一次后清除
+    """
+
+    def __init__(self, base=BACKOFF_BASE, maximum=BACKOFF_MAX, maxsize=ESTIMATE_CACHE_SIZE):
+        self.base = base
+        self.maximum = maximum
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    # 处于退避期时返回剩余秒数，否则返回 0
+    def blocked(self, code):
+        with self._lock:
+            entry = self._data.get(code)
+            if entry is None:
+                return 0
+            remaining = entry[1] - time.monotonic()
+            if remaining <= 0:
+                return 0
+            self.skipped += 1
+            return remaining
+
+    # 记录一次失败，返回本次的退避时间
+    def failure(self, code):
+        with self._lock:
+            failures = self._data[code][0] + 1 if code in self._data else 1
+            wait = min(self.base * 2 ** (failures - 1), self.maximum)
+            self._data[code] = (failures, time.monotonic() + wait)
+            self._data.move_to_end(code)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return wait
+
+    def success(self, code):
+        with self._lock:
+            self._data.pop(code, None)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "codes": len(self._data),
+                "blocked": sum(1 for _, retry_at in self._data.values() if retry_at > now),
+                "skipped": self.skipped,
+            }
+
+# 全局的基金查询失败退避表
+estimate_backoff = FailureBackoff()
@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+from starlette.concurrency import run_in_threadpool
+from app.database import get_db, close_db
+from app.services.estimate_cache import estimate_cache
+from app.services.fund_service import fetch_fund_estimates, load_hot_funds, ESTIMATE_CONCURRENCY
+from app.utils.market import seconds_until_next_session
+
+# 交易时段内的刷新间隔（秒）
+REFRESH_INTERVAL = 60
+# 每批刷新的基金数量
+REFRESH_BATCH_SIZE = 50
+
+class EstimateRefresher:
+    """
+    后台定时刷新热门基金的实时净值预估
+    热门基金 = 所有用户持有的基金 + /funds/all 展示的基金
+    交易时段内按固定间隔分批刷新，非交易时段休眠到下一个交易时段开盘
+    请求处理时直接读取 estimate_cache，上游请求量只与基金数量有关
+    """
+
+    def __init__(self, interval=REFRESH_INTERVAL, batch_size=REFRESH_BATCH_SIZE, concurrency=ESTIMATE_CONCURRENCY):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rounds = 0
+        self.last_refresh = None
+        self.last_count = 0
+        # 每完成一轮刷新加一，推送连接据此判断是否有新数据
+        self.version = 0
+        self._tick = asyncio.Condition()
+        self._task = None
+
+    # 所有用户持有的基金代码
+    def held_codes(self):
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT code FROM funds")
+        codes = [row[0] for row in cursor.fetchall()]
+        close_db(conn)
+        return codes
+
+    # 获取需要刷新的基金代码
+    def hot_codes(self):
+        codes = self.held_codes()
+        codes.extend(fund["code"] for fund in load_hot_funds())
+        return list(dict.fromkeys(codes))
+
+    # 刷新一轮
+    async def refresh_once(self):
+        codes = await run_in_threadpool(self.hot_codes)
+        # 缓存保留到下一轮刷新之后，保证请求处理时总能命中
+        ttl = max(seconds_until_next_session(), 0) + self.interval * 2
+        for i in range(0, len(codes), self.batch_size):
+            batch = codes[i:i + self.batch_size]
+            estimates = await run_in_threadpool(fetch_fund_estimates, batch, self.concurrency)
+            for code, data in estimates.items():
+                estimate_cache.put(code, data, ttl=ttl)
+
+        self.rounds += 1
+        self.last_count = len(codes)
+        self.last_refresh = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        async with self._tick:
+            self.version += 1
+            self._tick.notify_all()
+        return codes
+
+    # 等待下一轮刷新完成，超时返回当前版本
+    async def wait_for_tick(self, version, timeout=None):
+        async with self._tick:
+            try:
+                await asyncio.wait_for(self._tick.wait_for(lambda: self.version != version), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return self.version
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh_once()
+            except Exception as e:
+                print(f"刷新基金净值预估失败: {e}")
+            wait = seconds_until_next_session()
+            await asyncio.sleep(wait if wait > 0 else self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval": self.interval,
+            "rounds": self.rounds,
+            "version": self.version,
+            "codes": self.last_count,
+            "last_refresh": self.last_refresh,
+        }
+
+# 全局的后台刷新任务
+estimate_refresher = EstimateRefresher()
@@ -0,0 +1,173 @@
+import io
+import csv
+import tempfile
+from app.database import get_db, close_db
+from app.services.estimate_cache import estimate_cache
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl 为可选依赖，未安装时不支持导出 XLSX
+    openpyxl = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow 为可选依赖，未安装时不支持导出 Parquet
+    pyarrow = None
+
+# 每次从游标读取的行数
+EXPORT_BATCH_SIZE = 500
+# XLSX、Parquet 文件先写入临时文件，超过该大小时落盘
+EXPORT_SPOOL_SIZE = 4 * 1024 * 1024
+# 从临时文件读取并发送的块大小
+EXPORT_CHUNK_SIZE = 64 * 1024
+# 导出格式 -> (媒体类型, 扩展名)
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+EXPORT_FORMAT_PATTERN = "^(csv|xlsx|parquet)$"
+# 导出的数据集：持仓、交易流水或两者
+EXPORT_DATASET_PATTERN = "^(holdings|transactions|all)$"
+
+# 列定义：(列名, 类型)，类型用于生成 Parquet 结构
+HOLDING_COLUMNS = [("基金代码", "str"), ("基金名称", "str"), ("持有金额", "float"), ("持有份额", "float"), ("已实现盈亏", "float")]
+ESTIMATE_COLUMNS = [("估算净值", "float"), ("估算涨跌幅", "float"), ("估算时间", "str"), ("估算市值", "float")]
+TRANSACTION_COLUMNS = [
+    ("交易编号", "int"), ("基金代码", "str"), ("方向", "str"), ("份额", "float"),
+    ("净值", "float"), ("金额", "float"), ("已实现盈亏", "float"), ("交易时间", "str"),
+]
+
+# 检查导出参数，返回 (HTTP 状态码, 错误信息)，可以导出时返回 None
+def check_export(format, dataset):
+    if format == "xlsx" and openpyxl is None:
+        return 501, "服务器未安装 openpyxl，无法导出 XLSX"
+    if format == "parquet":
+        if pyarrow is None:
+            return 501, "服务器未安装 pyarrow，无法导出 Parquet"
+        if dataset == "all":
+            return 400, "Parquet 文件只能包含一个数据集，请选择 holdings 或 transactions"
+    return None
+
+# 按批从游标读取，避免一次性加载所有行
+def iter_cursor(cursor):
+    while True:
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        if not rows:
+            break
+        yield from rows
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+# 持仓行，估算数据只读取缓存，不请求上游接口；降级数据（上次的估值、模拟数据）不导出，估算列留空
+def iter_holdings(conn, user_id, estimates=True):
+    cursor = conn.cursor()
+    cursor.execute("SELECT code, name, amount, shares, realized_pnl FROM funds WHERE user_id = ? ORDER BY code", (user_id,))
+    for code, name, amount, shares, realized_pnl in iter_cursor(cursor):
+        row = [code, name, amount or 0, shares or 0, realized_pnl or 0]
+        if estimates:
+            cached = estimate_cache.peek(code) or {}
+            if cached.get("stale"):
+                cached = {}
+            nav = _number(cached.get("estimate"))
+            row += [nav, _number(cached.get("estimate_change")), cached.get("time"), nav * (shares or 0) if nav is not None else None]
+        yield row
+
+# 交易流水行，按基金代码和交易顺序排列
+def iter_transactions(conn, user_id):
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT id, code, side, shares, nav, amount, realized_pnl, created_at FROM transactions
+           WHERE user_id = ? ORDER BY code, id""",
+        (user_id,)
+    )
+    for row in iter_cursor(cursor):
+        yield list(row)
+
+# 要导出的数据集：[(名称, 列定义, 行迭代器)]
+def export_sections(conn, user_id, dataset, estimates=True):
+    sections = []
+    if dataset in ("holdings", "all"):
+        columns = HOLDING_COLUMNS + (ESTIMATE_COLUMNS if estimates else [])
+        sections.append(("持仓", columns, iter_holdings(conn, user_id, estimates)))
+    if dataset in ("transactions", "all"):
+        sections.append(("交易记录", TRANSACTION_COLUMNS, iter_transactions(conn, user_id)))
+    return sections
+
+# CSV：每批行编码后立即发送，多个数据集之间以空行分隔
+def csv_stream(sections):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # 带 BOM，Excel 打开时能正确识别中文
+    yield "\ufeff".encode("utf-8")
+    for index, (title, columns, rows) in enumerate(sections):
+        if index:
+            writer.writerow([])
+        writer.writerow([name for name, _ in columns])
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+# XLSX：只写模式逐行写入，每个数据集一个工作表
+def write_xlsx(sections, file):
+    workbook = openpyxl.Workbook(write_only=True)
+    for title, columns, rows in sections:
+        sheet = workbook.create_sheet(title)
+        sheet.append([name for name, _ in columns])
+        for row in rows:
+            sheet.append(row)
+    workbook.save(file)
+
+# Parquet：每批行写成一个 row group
+def write_parquet(sections, file):
+    types = {"str": pyarrow.string(), "float": pyarrow.float64(), "int": pyarrow.int64()}
+    title, columns, rows = sections[0]
+    schema = pyarrow.schema([(name, types[kind]) for name, kind in columns])
+    writer = pyarrow.parquet.ParquetWriter(file, schema)
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                writer.write_table(pyarrow.Table.from_pylist([dict(zip(schema.names, item)) for item in batch], schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pyarrow.Table.from_pylist([dict(zip(schema.names, item)) for item in batch], schema=schema))
+    finally:
+        writer.close()
+
+# 二进制格式先写入临时文件，再分块发送
+def file_stream(write, sections):
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as file:
+        write(sections, file)
+        file.seek(0)
+        while True:
+            chunk = file.read(EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+# 导出生成器，持有独立的数据库连接直到导出结束或客户端断开
+def export_stream(user_id, format="csv", dataset="holdings", estimates=True):
+    conn = get_db()
+    try:
+        sections = export_sections(conn, user_id, dataset, estimates)
+        if format == "xlsx":
+            yield from file_stream(write_xlsx, sections)
+        elif format == "parquet":
+            yield from file_stream(write_parquet, sections)
+        else:
+            yield from csv_stream(sections)
+    finally:
+        close_db(conn)
@@ -0,0 +1,224 @@
+import re
+import sys
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.database import get_db, close_db
+from app.services.http_client import http_get
+
+# 天天基金 F10 基本概况页
+F10_URL = "http://fundf10.eastmoney.com/jbgk_{code}.html"
+# 请求 F10 页面的并发数
+F10_CONCURRENCY = 4
+# 未收录的基金
+UNKNOWN = {"type": "其他", "sector": "其他", "index": ""}
+
+# 板块关键词，按顺序匹配基金名称和跟踪指数，先匹配到的优先
+SECTOR_KEYWORDS = [
+    ("半导体", ("半导体", "芯片", "集成电路")),
+    ("新能源", ("新能源", "光伏", "锂电", "电池", "碳中和", "低碳", "新能车", "电力设备", "储能")),
+    ("医药医疗", ("医药", "医疗", "生物", "健康", "创新药", "中药", "养老")),
+    ("消费", ("消费", "白酒", "酒", "食品", "饮料", "家电", "农业", "畜牧", "养殖", "旅游")),
+    ("科技", ("科技", "信息", "互联网", "计算机", "软件", "通信", "5G", "人工智能", "数字", "云计算", "大数据", "传媒", "游戏", "电子", "卫星")),
+    ("金融地产", ("金融", "银行", "证券", "券商", "保险", "地产", "非银")),
+    ("军工", ("军工", "国防", "航天", "航空")),
+    ("高端制造", ("制造", "装备", "机械", "机器人", "智造")),
+    ("资源周期", ("有色", "煤炭", "钢铁", "化工", "材料", "资源", "黄金", "能源", "石油")),
+    ("基建", ("基建", "建筑", "建材", "交通", "运输")),
+    ("红利价值", ("红利", "高股息", "价值")),
+    ("宽基", ("沪深300", "中证500", "中证800", "中证1000", "中证A500", "上证50", "上证180", "科创50", "创业板", "深证100", "北证50")),
+]
+# 没有匹配到板块关键词时按基金类型归类
+TYPE_SECTORS = {"债券型": "固收", "货币型": "货币", "QDII": "海外", "FOF": "FOF", "商品": "商品"}
+# 常见宽基指数，其余指数按 "中证/国证/上证/深证/恒生 + 名称" 的规则从基金名称中提取
+BROAD_INDEX_PATTERN = re.compile(
+    r"沪深300|中证500|中证800|中证1000|中证2000|中证A500|中证A50|上证50|上证180|科创50|科创100|"
+    r"创业板50|创业板|深证100|北证50|恒生科技|恒生医疗|恒生|纳斯达克100|纳斯达克|标普500"
+)
+# 基金公司简称，基金名称以公司简称开头，较长的简称优先匹配
+FUND_COMPANIES = sorted([
+    "易方达", "华夏", "南方", "嘉实", "博时", "广发", "汇添富", "富国", "招商", "工银", "鹏华", "景顺长城", "中欧",
+    "兴全", "兴证全球", "交银", "天弘", "华安", "国泰", "银华", "华宝", "大成", "长城", "建信", "诺安", "前海开源",
+    "融通", "华泰柏瑞", "中银", "农银", "民生加银", "万家", "平安", "东方红", "中庚", "睿远", "泓德", "信澳",
+    "国投瑞银", "汇丰晋信", "诺德", "长信", "申万菱信", "浦银安盛", "华商", "宝盈", "金鹰", "海富通", "财通",
+    "永赢", "中信保诚", "国联安", "光大", "摩根", "大摩", "西部利得", "创金合信", "华富", "长盛", "中海", "德邦",
+    "国寿安保", "中加", "鹏扬", "圆信永丰", "安信", "中金", "东方", "华泰", "国金", "国海富兰克林", "富兰克林",
+    "红土创新", "红塔红土", "东吴", "泰达宏利", "中融", "上银", "兴业", "浙商", "中邮", "英大", "北信瑞丰",
+    "天治", "新华", "金信", "九泰", "恒生前海", "同泰", "达诚", "朱雀", "易米", "格林", "博道", "惠升", "明亚",
+], key=len, reverse=True)
+# 缺少基金类型时（如本地初始化数据）按名称推断，按顺序匹配
+NAME_TYPES = [
+    ("QDII", "QDII"), ("FOF", "FOF"), ("货币", "货币型"), ("ETF", "指数型"), ("指数", "指数型"), ("联接", "指数型"),
+    ("债", "债券型"), ("混合", "混合型"), ("股票", "股票型"),
+]
+THEME_INDEX_PATTERN = re.compile(r"(?:中证|国证|上证|深证|中华)[\u4e00-\u9fa5A-Za-z0-9]{1,10}?(?=指数|ETF|联接|LOF|增强)")
+
+# 基金大类：取 "指数型-股票" 中的 "指数型"
+def base_type(fund_type):
+    return (fund_type or "").split("-")[0] or "其他"
+
+# 从基金名称中提取跟踪指数，非指数基金返回空字符串
+def extract_index(name, fund_type=""):
+    if "指数" not in fund_type and not re.search(r"指数|ETF|联接", name):
+        return ""
+    match = THEME_INDEX_PATTERN.search(name) or BROAD_INDEX_PATTERN.search(name)
+    return match.group(0) if match else ""
+
+# 根据基金名称、跟踪指数和类型判断板块
+def classify_sector(name, fund_type="", tracked_index=""):
+    text = f"{name} {tracked_index}"
+    for sector, keywords in SECTOR_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return sector
+    return TYPE_SECTORS.get(base_type(fund_type), "其他")
+
+# 根据基金名称推断基金类型
+def infer_type(name):
+    for keyword, fund_type in NAME_TYPES:
+        if keyword in name:
+            return fund_type
+    return ""
+
+# 根据基金名称判断基金公司，无法识别时为 "其他"
+def extract_company(name):
+    for company in FUND_COMPANIES:
+        if name.startswith(company):
+            return company
+    return "其他"
+
+# 按规则分类一只基金，返回 (类型, 板块, 跟踪指数, 基金公司)
+def classify(name, fund_type=""):
+    fund_type = fund_type or infer_type(name)
+    tracked_index = extract_index(name, fund_type)
+    return base_type(fund_type), classify_sector(name, fund_type, tracked_index), tracked_index, extract_company(name)
+
+# 请求 F10 基本概况，返回 (基金类型, 跟踪标的)
+def fetch_f10_profile(code):
+    response = http_get(F10_URL.format(code=code), timeout=10)
+    response.encoding = "utf-8"
+    html = response.text
+
+    def field(label):
+        match = re.search(label + r"</th>\s*<td[^>]*>(.*?)</td>", html, re.S)
+        return re.sub(r"<[^>]+>", "", match.group(1)).strip() if match else ""
+
+    fund_type = field("基金类型")
+    tracked_index = field("跟踪标的")
+    if not fund_type:
+        raise ValueError("F10 页面格式无法识别")
+    if "无跟踪标的" in tracked_index:
+        tracked_index = ""
+    return fund_type, re.sub(r"(收益率|指数)$", "", tracked_index)
+
+# 按基金基础信息批量重建规则分类，不覆盖来自 F10 的分类，不提交事务
+def rebuild_classification(conn):
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor = conn.cursor()
+    cursor.execute("SELECT code, name, type FROM fund_master")
+    rows = [(code,) + classify(name, fund_type) + (now,) for code, name, fund_type in cursor.fetchall()]
+    conn.executemany(
+        """INSERT INTO fund_classification (code, type, sector, tracked_index, company, source, updated_at)
+           VALUES (?, ?, ?, ?, ?, 'rule', ?)
+           ON CONFLICT(code) DO UPDATE SET type = excluded.type, sector = excluded.sector,
+           tracked_index = excluded.tracked_index, company = excluded.company, updated_at = excluded.updated_at
+           WHERE fund_classification.source = 'rule'""",
+        rows
+    )
+    return len(rows)
+
+# 用 F10 数据更新指定基金的分类，返回成功更新的条数，不提交事务
+def update_from_f10(conn, codes):
+    if not codes:
+        return 0
+    placeholders = ",".join("?" * len(codes))
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT code, name FROM fund_master WHERE code IN ({placeholders})", list(codes))
+    names = dict(cursor.fetchall())
+
+    def fetch(code):
+        try:
+            return code, fetch_f10_profile(code)
+        except Exception as e:
+            print(f"获取基金{code}F10信息失败: {e}")
+            return code, None
+
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    with ThreadPoolExecutor(max_workers=F10_CONCURRENCY) as executor:
+        for code, profile in executor.map(fetch, codes):
+            if profile is None:
+                continue
+            fund_type, tracked_index = profile
+            name = names.get(code, "")
+            rows.append((
+                code, base_type(fund_type), classify_sector(name, fund_type, tracked_index), tracked_index,
+                extract_company(name), now
+            ))
+    conn.executemany(
+        """INSERT INTO fund_classification (code, type, sector, tracked_index, company, source, updated_at)
+           VALUES (?, ?, ?, ?, ?, 'f10', ?)
+           ON CONFLICT(code) DO UPDATE SET type = excluded.type, sector = excluded.sector,
+           tracked_index = excluded.tracked_index, company = excluded.company, source = 'f10', updated_at = excluded.updated_at""",
+        rows
+    )
+    return len(rows)
+
+class FundClassifier:
+    """
+    基金分类的内存索引
+    从 fund_classification 表一次性加载到字典，查询为 O(1)，刷新时整体替换
+    """
+
+    def __init__(self):
+        self._data = None
+        self._lock = threading.Lock()
+
+    def load(self, conn=None):
+        own = conn is None
+        conn = conn or get_db()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT code, type, sector, tracked_index FROM fund_classification")
+            # 类型、板块取值很少，intern 后所有基金共用同一个字符串对象
+            data = {
+                code: (sys.intern(fund_type or ""), sys.intern(sector or ""), tracked_index)
+                for code, fund_type, sector, tracked_index in cursor.fetchall()
+            }
+        finally:
+            if own:
+                close_db(conn)
+        self._data = data
+        return len(data)
+
+    def _ensure_loaded(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self.load()
+
+    def get(self, code):
+        self._ensure_loaded()
+        entry = self._data.get(code)
+        if entry is None:
+            return dict(UNKNOWN)
+        return {"type": entry[0], "sector": entry[1], "index": entry[2]}
+
+    def stats(self):
+        return {"loaded": self._data is not None, "size": len(self._data or {})}
+
+# 全局的基金分类索引
+fund_classifier = FundClassifier()
+
+# 重建分类表并重新加载内存索引，held_codes 为用户持有的基金，额外使用 F10 数据
+def refresh_classification(held_codes=()):
+    conn = get_db()
+    try:
+        count = rebuild_classification(conn)
+        conn.commit()
+        if held_codes:
+            update_from_f10(conn, list(held_codes))
+            conn.commit()
+        fund_classifier.load(conn)
+    finally:
+        close_db(conn)
+    return count
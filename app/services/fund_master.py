@@ -0,0 +1,240 @@
+import re
+import json
+import asyncio
+import datetime
+from pathlib import Path
+from starlette.concurrency import run_in_threadpool
+from app.database import get_db, close_db
+from app.services.http_client import http_get
+from app.services.fund_service import load_hot_funds
+from app.services.fund_classification import fund_classifier, rebuild_classification, refresh_classification
+
+# 天天基金全部基金列表：[代码, 拼音缩写, 名称, 类型, 全拼]
+FUND_LIST_URL = "http://fund.eastmoney.com/js/fundcode_search.js"
+# 天天基金基金经理列表，每个经理一行，包含其管理的基金代码
+FUND_MANAGER_URL = "http://fund.eastmoney.com/Data/FundDataPortfolio_Interface.aspx"
+# 基金列表为空时用于初始化的本地数据
+SEED_FILE = Path("funds.json")
+# 全量刷新间隔（秒）
+FUND_MASTER_REFRESH_INTERVAL = 24 * 3600
+# 刷新失败后的重试间隔（秒）
+FUND_MASTER_RETRY_INTERVAL = 600
+# 本地初始化数据的更新时间，保证启动后会尽快全量刷新
+SEED_UPDATED_AT = "1970-01-01 00:00:00"
+# 搜索默认返回的条数
+SEARCH_LIMIT = 20
+# 全文检索先取出的候选条数，再按匹配位置重新排序
+SEARCH_CANDIDATES = 200
+
+# 请求全部基金列表，返回 [(代码, 名称, 拼音缩写, 全拼, 类型)]
+def fetch_fund_list():
+    response = http_get(FUND_LIST_URL, timeout=15)
+    response.encoding = "utf-8"
+    match = re.search(r"=\s*(\[.*\])\s*;?\s*$", response.text, re.S)
+    if not match:
+        raise ValueError("基金列表格式无法识别")
+
+    rows = []
+    for item in json.loads(match.group(1)):
+        if len(item) >= 5 and item[0] and item[2]:
+            rows.append((item[0], item[2], item[1], item[4], item[3]))
+    return rows
+
+# 请求基金经理列表，返回 {基金代码: 基金经理}，同一基金有多位经理时以顿号分隔
+def fetch_fund_managers():
+    params = {"dt": 14, "mc": "returnjson", "ft": "all", "pn": 50000, "pi": 1, "sc": "abbname", "st": "asc"}
+    response = http_get(FUND_MANAGER_URL, params=params, timeout=15)
+    match = re.search(r"data\s*:\s*(\[\[.*?\]\])\s*,\s*record", response.text, re.S)
+    if not match:
+        raise ValueError("基金经理列表格式无法识别")
+
+    managers = {}
+    for item in json.loads(match.group(1)):
+        # 字段顺序：经理ID,姓名,公司ID,公司名称,基金代码（逗号分隔）,...
+        if len(item) < 5:
+            continue
+        for code in item[4].split(","):
+            if code:
+                managers.setdefault(code, []).append(item[1])
+    return {code: "、".join(names) for code, names in managers.items()}
+
+# 批量写入基金基础信息并重建全文索引，不提交事务
+def save_fund_master(conn, rows, managers=None, updated_at=None):
+    """
+    rows: [(代码, 名称, 拼音缩写, 全拼, 类型)]
+    managers 为空或缺少某只基金时保留已有的基金经理
+    """
+    managers = managers or {}
+    now = updated_at or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany(
+        """INSERT INTO fund_master (code, name, abbr, pinyin, type, manager, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(code) DO UPDATE SET name = excluded.name, abbr = excluded.abbr, pinyin = excluded.pinyin,
+           type = excluded.type, updated_at = excluded.updated_at,
+           manager = CASE WHEN excluded.manager != '' THEN excluded.manager ELSE fund_master.manager END""",
+        [(code, name, abbr, pinyin, fund_type, managers.get(code, ""), now) for code, name, abbr, pinyin, fund_type in rows]
+    )
+    conn.execute("INSERT INTO fund_master_fts (fund_master_fts) VALUES ('rebuild')")
+
+# 基金列表最近一次刷新时间和条数
+def get_master_state(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(updated_at), COUNT(*) FROM fund_master")
+    return cursor.fetchone()
+
+# 基金列表为空时用本地数据初始化，保证离线时也能搜索
+def seed_fund_master(conn):
+    if get_master_state(conn)[1]:
+        return 0
+    funds = {fund["code"]: fund["name"] for fund in load_hot_funds()}
+    if SEED_FILE.exists():
+        with open(SEED_FILE, encoding="utf-8") as f:
+            funds.update({fund["code"]: fund["name"] for fund in json.load(f)})
+    save_fund_master(conn, [(code, name, "", "", "") for code, name in funds.items()], updated_at=SEED_UPDATED_AT)
+    conn.commit()
+    return len(funds)
+
+# 从天天基金全量刷新基金基础信息，返回写入条数
+def refresh_fund_master():
+    rows = fetch_fund_list()
+    try:
+        managers = fetch_fund_managers()
+    except Exception as e:
+        print(f"获取基金经理列表失败: {e}")
+        managers = {}
+
+    conn = get_db()
+    try:
+        save_fund_master(conn, rows, managers)
+        conn.commit()
+    finally:
+        close_db(conn)
+    return len(rows)
+
+# 用户持有的基金代码
+def get_held_codes():
+    conn = get_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT code FROM funds")
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        close_db(conn)
+
+# 搜索结果排序：代码完全匹配、代码前缀、拼音缩写前缀、名称前缀，其次名称越短越靠前
+def _rank(keyword, row):
+    lowered = keyword.lower()
+    return (
+        row["code"] != keyword,
+        not row["code"].startswith(keyword),
+        not row["abbr"].lower().startswith(lowered),
+        not row["name"].startswith(keyword),
+        len(row["name"]),
+    )
+
+# 在本地基金列表中搜索，支持代码前缀、名称、拼音缩写和全拼，不请求上游接口
+def search_fund_master(conn, keyword, limit=SEARCH_LIMIT):
+    keyword = keyword.strip()
+    if not keyword:
+        return []
+    cursor = conn.cursor()
+    if keyword.isdigit():
+        # 代码前缀走主键范围查询，":" 是 ASCII 中紧跟 "9" 的字符
+        cursor.execute(
+            "SELECT code, name, abbr, type, manager FROM fund_master WHERE code >= ? AND code < ? ORDER BY code LIMIT ?",
+            (keyword, keyword + ":", limit)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    if len(keyword) >= 3:
+        # trigram 分词要求关键词至少 3 个字符，整体作为短语做子串匹配
+        cursor.execute(
+            """SELECT m.code, m.name, m.abbr, m.type, m.manager FROM fund_master_fts f JOIN fund_master m ON m.rowid = f.rowid
+               WHERE fund_master_fts MATCH ? ORDER BY f.rank LIMIT ?""",
+            ('"' + keyword.replace('"', '""') + '"', SEARCH_CANDIDATES)
+        )
+    else:
+        # 一两个字符的关键词无法使用 trigram 索引，直接扫描基础信息表
+        pattern = "%" + keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        cursor.execute(
+            """SELECT code, name, abbr, type, manager FROM fund_master
+               WHERE name LIKE ? ESCAPE '\\' OR abbr LIKE ? ESCAPE '\\' LIMIT ?""",
+            (pattern, pattern, SEARCH_CANDIDATES)
+        )
+    rows = [dict(row) for row in cursor.fetchall()]
+    rows.sort(key=lambda row: _rank(keyword, row))
+    return rows[:limit]
+
+class FundMasterRefresher:
+    """
+    后台维护本地基金列表和基金分类
+    启动时基金列表为空则先用本地数据初始化，之后每天从天天基金全量刷新一次
+    刷新后按新的基金列表重建分类，用户持有的基金再用 F10 数据校正
+    """
+
+    def __init__(self, interval=FUND_MASTER_REFRESH_INTERVAL):
+        self.interval = interval
+        self.last_refresh = None
+        self.count = 0
+        self._task = None
+        self._prepared = False
+
+    # 启动时的准备工作：基金列表为空时用本地数据初始化，分类表为空（首次启动或刚升级）时先按规则生成，再载入分类
+    def _prepare(self):
+        conn = get_db()
+        try:
+            seed_fund_master(conn)
+            if conn.execute("SELECT 1 FROM fund_classification LIMIT 1").fetchone() is None:
+                rebuild_classification(conn)
+                conn.commit()
+            fund_classifier.load(conn)
+        finally:
+            close_db(conn)
+
+    # 距离上次刷新的秒数，从未刷新过时为 None
+    def _age(self):
+        conn = get_db()
+        try:
+            updated_at, self.count = get_master_state(conn)
+        finally:
+            close_db(conn)
+        if not updated_at:
+            return None
+        return (datetime.datetime.now() - datetime.datetime.strptime(updated_at, "%Y-%m-%d %H:%M:%S")).total_seconds()
+
+    async def run(self):
+        while True:
+            # 任何一步失败（包括数据库错误）都只打印日志并稍后重试，不结束后台任务
+            try:
+                if not self._prepared:
+                    await run_in_threadpool(self._prepare)
+                    self._prepared = True
+                age = await run_in_threadpool(self._age)
+                delay = self.interval - age if age is not None else 0
+                if delay <= 0:
+                    self.count = await run_in_threadpool(refresh_fund_master)
+                    await run_in_threadpool(refresh_classification, get_held_codes())
+                    self.last_refresh = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    delay = self.interval
+            except Exception as e:
+                print(f"刷新基金列表失败: {e}")
+                delay = FUND_MASTER_RETRY_INTERVAL
+            await asyncio.sleep(delay)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {"running": self._task is not None, "count": self.count, "last_refresh": self.last_refresh}
+
+# 全局的基金列表刷新任务
+fund_master_refresher = FundMasterRefresher()
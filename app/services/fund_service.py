@@ -1,93 +1,241 @@
-import requests
 import json
 import random
+import asyncio
 import datetime
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from starlette.concurrency import run_in_threadpool
 from app.database import get_db, close_db
+from app.services.estimate_cache import estimate_cache, estimate_backoff
+from app.services.http_client import http_get, circuit_open, CircuitOpenError
+from app.services.fund_classification import fund_classifier
 
-# 获取基金类型和板块信息
+# 并发获取净值预估时的最大并发数
+ESTIMATE_CONCURRENCY = 10
+# 天天基金单只基金实时估值接口
+ESTIMATE_URL = "http://fundgz.1234567.com.cn/js/{code}.js"
+# 天天基金批量行情接口，一次请求可查询多个基金
+BATCH_ESTIMATE_URL = "https://fundmobapi.eastmoney.com/FundMNewApi/FundMNFInfo"
+# 批量接口每次查询的基金数量
+BATCH_ESTIMATE_SIZE = 50
+
+# 热门基金列表（/funds/all 展示的基金），修改后下次读取时生效
+HOT_FUNDS_FILE = Path("hot_funds.json")
+# 已读取的热门基金列表：(文件修改时间, 基金列表)
+_hot_funds = (None, [])
+_hot_funds_lock = threading.Lock()
+
+# 读取热门基金列表 [{"code", "name"}]，文件未修改时直接返回上次的结果，读取失败时沿用上次的列表
+def load_hot_funds():
+    global _hot_funds
+    try:
+        mtime = HOT_FUNDS_FILE.stat().st_mtime
+    except OSError as e:
+        print(f"读取热门基金列表失败: {e}")
+        return _hot_funds[1]
+    with _hot_funds_lock:
+        if _hot_funds[0] != mtime:
+            try:
+                with open(HOT_FUNDS_FILE, encoding="utf-8") as f:
+                    funds = [{"code": fund["code"], "name": fund["name"]} for fund in json.load(f)]
+                _hot_funds = (mtime, list({fund["code"]: fund for fund in funds}.values()))
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"热门基金列表格式错误: {e}")
+                _hot_funds = (mtime, _hot_funds[1])
+        return _hot_funds[1]
+
+# 获取基金类型、板块和跟踪指数，从内存中的分类索引查询
 def get_fund_type_and_sector(code):
     try:
-        # 这里可以根据基金代码的规则判断基金类型
-        # 也可以使用其他API获取更详细的信息
-        # 以下是基于基金代码的简单判断
-        if code.startswith('00') or code.startswith('15'):
-            fund_type = "混合型"
-        elif code.startswith('16'):
-            fund_type = "股票型"
-        elif code.startswith('20'):
-            fund_type = "债券型"
-        elif code.startswith('30'):
-            fund_type = "指数型"
-        elif code.startswith('40') or code.startswith('110022') or code.startswith('161128') or code.startswith('513050'):
-            fund_type = "QDII"
-        elif code.startswith('50'):
-            fund_type = "货币型"
-        elif code.startswith('60'):
-            fund_type = "保本型"
-        else:
-            fund_type = "其他"
-        
-        # 简单的板块判断，实际应用中可能需要更复杂的逻辑
-        sector = "金融地产" if "金融" in code or "地产" in code else "其他"
-        
-        return {
-            "type": fund_type,
-            "sector": sector
-        }
+        return fund_classifier.get(code)
     except Exception as e:
+        print(f"获取基金{code}分类失败: {e}")
         return {
             "type": "-",
-            "sector": "-"
+            "sector": "-",
+            "index": ""
         }
 
-# 获取基金实时净值预估
+# 获取基金实时净值预估（优先读取缓存）
 def get_fund_estimate(code):
+    return estimate_cache.get(code, fetch_fund_estimate)
+
+# 从天天基金网获取基金实时净值预估
+def fetch_fund_estimate(code):
+    """
+    该基金处于失败退避期或上游主机熔断时不发出请求，立即返回上一次的数据
+    请求失败时记录退避，连续失败的基金不会在每次轮询时都等待超时
+    """
+    url = ESTIMATE_URL.format(code=code)
+    if estimate_backoff.blocked(code) or circuit_open(url):
+        return fallback_estimate(code, save=False)
     try:
         # 使用天天基金网API获取实时净值预估
-        url = f"http://fundgz.1234567.com.cn/js/{code}.js"
-        response = requests.get(url, timeout=5)
+        response = http_get(url)
         data = response.text.strip()[8:-2]  # 去掉回调函数包装
         fund_data = json.loads(data)
         
         # 获取基金类型和板块信息
         type_and_sector = get_fund_type_and_sector(code)
         
-        return {
+        result = {
             "code": fund_data["fundcode"],
             "name": fund_data["name"],
             "estimate": fund_data["gsz"],
             "estimate_change": fund_data["gszzl"],
             "time": fund_data["gztime"],
             "type": type_and_sector["type"],
-            "sector": type_and_sector["sector"]
+            "sector": type_and_sector["sector"],
+            "index": type_and_sector["index"],
+            "stale": False
         }
+    except CircuitOpenError:
+        return fallback_estimate(code, save=False)
     except Exception as e:
-        # 如果API调用失败，使用模拟的涨跌规则
-        type_and_sector = get_fund_type_and_sector(code)
-        
-        # 获取或生成历史净值
-        nav, change_rate = generate_fund_nav(code)
-        
-        # 确保时间字段实时更新
-        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        
-        return {
-            "code": code,
-            "name": "未知基金",
-            "estimate": str(nav),
-            "estimate_change": str(change_rate),
-            "time": current_time,
-            "type": type_and_sector["type"],
-            "sector": type_and_sector["sector"]
+        wait = estimate_backoff.failure(code)
+        print(f"获取基金{code}净值预估失败，{wait:.0f}秒内不再请求: {e}")
+        return fallback_estimate(code)
+    estimate_backoff.success(code)
+    return result
+
+# 上游不可用时的预估数据：优先返回上一次的数据并标记为过期，从未获取过时使用模拟的涨跌规则
+def fallback_estimate(code, save=True):
+    """save 为 False 时模拟净值不写入数据库"""
+    last = estimate_cache.peek(code)
+    if last is not None:
+        last["stale"] = True
+        return last
+
+    type_and_sector = get_fund_type_and_sector(code)
+    
+    # 获取或生成历史净值
+    nav, change_rate = generate_fund_nav(code, save)
+    
+    # 确保时间字段实时更新
+    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    
+    return {
+        "code": code,
+        "name": "未知基金",
+        "estimate": str(nav),
+        "estimate_change": str(change_rate),
+        "time": current_time,
+        "type": type_and_sector["type"],
+        "sector": type_and_sector["sector"],
+        "index": type_and_sector["index"],
+        "stale": True
+    }
+
+# 通过批量行情接口获取多个基金的实时净值预估
+def fetch_fund_estimates_batch(codes):
+    """
+    按 BATCH_ESTIMATE_SIZE 分批请求，返回 {基金代码: 预估数据}
+    接口未返回或没有估值的基金不在结果中
+    """
+    result = {}
+    for i in range(0, len(codes), BATCH_ESTIMATE_SIZE):
+        chunk = codes[i:i + BATCH_ESTIMATE_SIZE]
+        params = {
+            "pageIndex": 1,
+            "pageSize": len(chunk),
+            "plat": "Android",
+            "appType": "ttjj",
+            "product": "EFund",
+            "Version": 1,
+            "deviceid": "fund",
+            "Fcodes": ",".join(chunk)
         }
+        try:
+            response = http_get(BATCH_ESTIMATE_URL, params=params)
+            datas = response.json().get("Datas") or []
+        except Exception as e:
+            print(f"批量获取基金净值预估失败: {e}")
+            continue
+
+        for item in datas:
+            code = item.get("FCODE")
+            estimate = item.get("GSZ")
+            if code not in chunk or not estimate or estimate == "--":
+                continue
+            type_and_sector = get_fund_type_and_sector(code)
+            result[code] = {
+                "code": code,
+                "name": item.get("SHORTNAME") or "未知基金",
+                "estimate": estimate,
+                "estimate_change": item.get("GSZZL") or "0.00",
+                "time": item.get("GZTIME") or "",
+                "type": type_and_sector["type"],
+                "sector": type_and_sector["sector"],
+                "index": type_and_sector["index"],
+                "stale": False
+            }
+    return result
+
+# 获取多个基金的实时净值预估，批量接口缺失的基金再逐个查询
+def fetch_fund_estimates(codes, concurrency=ESTIMATE_CONCURRENCY):
+    codes = list(dict.fromkeys(codes))
+    result = fetch_fund_estimates_batch(codes)
+    missing = [code for code in codes if code not in result]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(missing)))) as executor:
+            result.update(zip(missing, executor.map(fetch_fund_estimate, missing)))
+    return result
+
+# 获取多个基金的实时净值预估（优先读取缓存）
+def get_fund_estimates(codes, concurrency=ESTIMATE_CONCURRENCY):
+    codes = list(dict.fromkeys(codes))
+    result = {}
+    for code in codes:
+        cached = estimate_cache.get_fresh(code)
+        if cached is not None:
+            result[code] = cached
+    missing = [code for code in codes if code not in result]
+    if missing:
+        for code, data in fetch_fund_estimates(missing, concurrency).items():
+            estimate_cache.put(code, data)
+            result[code] = data
+    return result
+
+# 并发获取多个基金的实时净值预估
+async def get_fund_estimates_async(codes, concurrency=ESTIMATE_CONCURRENCY):
+    """
+    缓存未命中的基金先走批量接口，批量接口缺失的基金
+    在线程池中并发执行 get_fund_estimate，不阻塞事件循环
+    concurrency 限制同时进行的上游请求数，返回 {基金代码: 预估数据}
+    """
+    codes = list(dict.fromkeys(codes))
+    result = {}
+    for code in codes:
+        # 缓存命中时直接返回，避免切换线程
+        cached = estimate_cache.get_fresh(code)
+        if cached is not None:
+            result[code] = cached
+
+    missing = [code for code in codes if code not in result]
+    if missing:
+        batch = await run_in_threadpool(fetch_fund_estimates_batch, missing)
+        for code, data in batch.items():
+            estimate_cache.put(code, data)
+        result.update(batch)
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def fetch(code):
+        async with semaphore:
+            # 未命中已在 get_fresh 中计数
+            result[code] = await run_in_threadpool(estimate_cache.get, code, fetch_fund_estimate, False)
+
+    await asyncio.gather(*(fetch(code) for code in codes if code not in result))
+    return {code: result[code] for code in codes}
 
 # 生成或获取基金净值
-def generate_fund_nav(code):
+def generate_fund_nav(code, save=True):
     """
     生成基金净值，实现涨跌规则
     1. 首先尝试从历史净值表中获取最近的净值
     2. 如果没有历史数据，生成初始净值
-    3. 根据涨跌规则生成新的净值
+    3. 根据涨跌规则生成新的净值，save 为 True 时保存为当天的模拟净值
     """
     conn = get_db()
     cursor = conn.cursor()
@@ -111,12 +259,16 @@ def generate_fund_nav(code):
         change_rate = 0
     
     # 保存今天的净值
-    try:
-        cursor.execute("INSERT OR REPLACE INTO fund_history (code, date, nav, change_rate) VALUES (?, ?, ?, ?)", 
-                      (code, today, new_nav, change_rate))
-        conn.commit()
-    except Exception as e:
-        print(f"保存净值历史失败: {e}")
+    if save:
+        try:
+            # 只覆盖当天的模拟净值，不覆盖已同步的真实净值
+            cursor.execute("""INSERT INTO fund_history (code, date, nav, change_rate, source) VALUES (?, ?, ?, ?, 'mock')
+                              ON CONFLICT(code, date) DO UPDATE SET nav = excluded.nav, change_rate = excluded.change_rate
+                              WHERE fund_history.source = 'mock'""", 
+                          (code, today, new_nav, change_rate))
+            conn.commit()
+        except Exception as e:
+            print(f"保存净值历史失败: {e}")
     
     close_db(conn)
     return new_nav, round(change_rate, 2)
@@ -0,0 +1,141 @@
+import asyncio
+import datetime
+from starlette.concurrency import run_in_threadpool
+from app.database import get_db, close_db
+from app.services.http_client import http_get
+
+# 东方财富K线接口
+KLINE_URL = "https://push2his.eastmoney.com/api/qt/stock/kline/get"
+GOLD_SECID = "118.AU9999"
+GOLD_CODE = "AU9999"
+# 存储的K线周期：名称 -> (东方财富 klt 参数, 首次同步拉取的条数)
+RESOLUTIONS = {
+    "1m": (1, 1000),
+    "1d": (101, 250),
+}
+# 后台同步间隔（秒）
+INGEST_INTERVALS = {
+    "1m": 60,
+    "1d": 3600,
+}
+
+# 请求K线，返回 [(时间, 开盘, 收盘, 最高, 最低, 成交量)]，按时间从旧到新
+def fetch_klines(resolution, beg="0", limit=None):
+    klt, default_limit = RESOLUTIONS[resolution]
+    params = {
+        "secid": GOLD_SECID,
+        "fields1": "f1,f2,f3,f4,f5,f6,f7,f8,f9,f10,f11,f12,f13",
+        "fields2": "f51,f52,f53,f54,f55,f56,f57,f58",
+        "klt": klt,
+        "fqt": 0,
+        "beg": beg,
+        "end": "20500101",
+        "lmt": limit or default_limit
+    }
+    headers = {"Referer": "https://quote.eastmoney.com/q/118.AU9999.html"}
+    response = http_get(KLINE_URL, params=params, headers=headers, timeout=10)
+    data = response.json()
+
+    rows = []
+    for kline in ((data or {}).get("data") or {}).get("klines") or []:
+        # 字段顺序：时间,开盘,收盘,最高,最低,成交量,成交额,振幅
+        parts = kline.split(",")
+        if len(parts) < 5:
+            continue
+        try:
+            volume = float(parts[5]) if len(parts) > 5 else 0
+            rows.append((parts[0], float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4]), volume))
+        except ValueError:
+            continue
+    return rows
+
+# 本地最新一根K线的时间
+def get_latest_ts(conn, resolution):
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(ts) FROM gold_kline WHERE code = ? AND resolution = ?", (GOLD_CODE, resolution))
+    return cursor.fetchone()[0]
+
+# 写入K线，最新一根K线可能尚未走完，已存在时覆盖
+def save_klines(conn, resolution, rows):
+    conn.executemany(
+        """INSERT INTO gold_kline (code, resolution, ts, open, close, high, low, volume) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(code, resolution, ts) DO UPDATE SET open = excluded.open, close = excluded.close,
+           high = excluded.high, low = excluded.low, volume = excluded.volume""",
+        [(GOLD_CODE, resolution) + row for row in rows]
+    )
+
+# 增量同步：只写入本地最新K线及之后的数据，返回写入条数
+def sync_klines(resolution):
+    conn = get_db()
+    try:
+        latest = get_latest_ts(conn, resolution)
+        if latest:
+            # 接口按日期过滤，从最新K线所在日期开始拉取，再去掉已存储的部分
+            rows = fetch_klines(resolution, beg=latest[:10].replace("-", ""))
+            rows = [row for row in rows if row[0] >= latest]
+        else:
+            rows = fetch_klines(resolution)
+        save_klines(conn, resolution, rows)
+        conn.commit()
+        return len(rows)
+    finally:
+        close_db(conn)
+
+# 读取 [start, end] 范围内最近 limit 根K线，按时间从旧到新
+# end 按前缀匹配，limit 为 None 时不限制条数
+def get_klines(resolution, limit, start=None, end=None):
+    conn = get_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT ts, open, close, high, low FROM gold_kline
+               WHERE code = ? AND resolution = ? AND ts >= ? AND ts <= ? ORDER BY ts DESC LIMIT ?""",
+            # "~" 大于时间字符串中的所有字符，end + "~" 可包含以 end 开头的所有时间
+            (GOLD_CODE, resolution, start or "", (end or "9999") + "~", -1 if limit is None else limit)
+        )
+        rows = cursor.fetchall()
+    finally:
+        close_db(conn)
+    return [tuple(row) for row in reversed(rows)]
+
+class GoldKlineIngester:
+    """
+    后台按周期同步上海金K线到本地
+    每个周期独立计时，分钟线每分钟同步一次，日线每小时同步一次
+    """
+
+    def __init__(self, intervals=INGEST_INTERVALS):
+        self.intervals = intervals
+        self.last_sync = {}
+        self._task = None
+
+    async def run(self):
+        next_run = {resolution: 0.0 for resolution in self.intervals}
+        loop = asyncio.get_running_loop()
+        while True:
+            for resolution, interval in self.intervals.items():
+                if loop.time() < next_run[resolution]:
+                    continue
+                try:
+                    count = await run_in_threadpool(sync_klines, resolution)
+                    self.last_sync[resolution] = (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), count)
+                except Exception as e:
+                    print(f"同步上海金{resolution}K线失败: {e}")
+                next_run[resolution] = loop.time() + interval
+            await asyncio.sleep(max(0.0, min(next_run.values()) - loop.time()))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+# 全局的K线同步任务
+gold_kline_ingester = GoldKlineIngester()
@@ -0,0 +1,211 @@
+import asyncio
+import datetime
+from starlette.concurrency import run_in_threadpool
+from app.database import get_db, close_db
+from app.services.http_client import http_get
+
+# 天天基金历史净值接口
+LSJZ_URL = "http://api.fund.eastmoney.com/f10/lsjz"
+# 每页请求的净值条数
+LSJZ_PAGE_SIZE = 31
+# 单次同步最多请求的页数，防止异常数据导致无限翻页
+LSJZ_MAX_PAGES = 40
+# 两次增量同步之间的最短间隔（秒），间隔内的请求只读本地数据
+HISTORY_SYNC_INTERVAL = 3600
+# 默认返回的历史净值天数
+HISTORY_DAYS = 31
+
+# 请求一页历史净值，返回 [(日期, 单位净值, 日涨跌幅)]，按日期从新到旧
+def fetch_nav_page(code, page_index=1, start_date="", end_date=""):
+    params = {
+        "fundCode": code,
+        "pageIndex": page_index,
+        "pageSize": LSJZ_PAGE_SIZE,
+        "startDate": start_date,
+        "endDate": end_date
+    }
+    headers = {"Referer": f"http://fund.eastmoney.com/{code}.html"}
+    response = http_get(LSJZ_URL, params=params, headers=headers, timeout=10)
+    data = response.json()
+
+    rows = []
+    for item in ((data or {}).get("Data") or {}).get("LSJZList") or []:
+        date = item.get("FSRQ", "")
+        try:
+            nav = float(item.get("DWJZ"))
+        except (TypeError, ValueError):
+            continue
+        try:
+            change_rate = float(item.get("JZZZL"))
+        except (TypeError, ValueError):
+            change_rate = 0
+        if date:
+            rows.append((date, nav, change_rate))
+    return rows
+
+# 写入历史净值，同一天的数据（包括模拟数据）会被覆盖
+def save_nav_rows(conn, code, rows):
+    conn.executemany(
+        """INSERT INTO fund_history (code, date, nav, change_rate, source) VALUES (?, ?, ?, ?, 'lsjz')
+           ON CONFLICT(code, date) DO UPDATE SET nav = excluded.nav, change_rate = excluded.change_rate, source = 'lsjz'""",
+        [(code, date, nav, change_rate) for date, nav, change_rate in rows]
+    )
+
+# 读取同步状态
+def get_sync_state(conn, code):
+    cursor = conn.cursor()
+    cursor.execute("SELECT synced_at, exhausted FROM fund_history_sync WHERE code = ?", (code,))
+    return cursor.fetchone()
+
+# 更新同步状态
+def set_sync_state(conn, code, exhausted=None):
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute(
+        """INSERT INTO fund_history_sync (code, synced_at, exhausted) VALUES (?, ?, COALESCE(?, 0))
+           ON CONFLICT(code) DO UPDATE SET synced_at = excluded.synced_at,
+           exhausted = COALESCE(?, fund_history_sync.exhausted)""",
+        (code, now, exhausted, exhausted)
+    )
+
+# 本地已存储的真实净值范围和条数
+def get_stored_range(conn, code):
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT MIN(date), MAX(date), COUNT(*) FROM fund_history WHERE code = ? AND source = 'lsjz'",
+        (code,)
+    )
+    return cursor.fetchone()
+
+# 增量同步：只拉取本地最新日期之后的净值
+def sync_latest(conn, code):
+    earliest, latest, count = get_stored_range(conn, code)
+    start_date = ""
+    if latest:
+        start_date = (datetime.datetime.strptime(latest, "%Y-%m-%d") + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+
+    for page_index in range(1, LSJZ_MAX_PAGES + 1):
+        rows = fetch_nav_page(code, page_index, start_date=start_date)
+        save_nav_rows(conn, code, rows)
+        # 首次同步只取第一页，更早的数据按需加载
+        if not latest or len(rows) < LSJZ_PAGE_SIZE:
+            break
+    set_sync_state(conn, code)
+    conn.commit()
+
+# 向前加载更早的净值，直到本地数据不少于 days 条或接口没有更多数据
+def extend_history(conn, code, days):
+    exhausted = 0
+    for _ in range(LSJZ_MAX_PAGES):
+        earliest, latest, count = get_stored_range(conn, code)
+        if count >= days:
+            break
+        end_date = ""
+        if earliest:
+            end_date = (datetime.datetime.strptime(earliest, "%Y-%m-%d") - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+        rows = fetch_nav_page(code, 1, end_date=end_date)
+        save_nav_rows(conn, code, rows)
+        if len(rows) < LSJZ_PAGE_SIZE:
+            exhausted = 1
+            break
+    set_sync_state(conn, code, exhausted)
+    conn.commit()
+
+# 按需同步历史净值，同步失败时只打印日志，继续使用本地数据
+def ensure_history(conn, code, days=HISTORY_DAYS):
+    """
+    1. 距离上次同步超过 HISTORY_SYNC_INTERVAL 时，增量拉取最新净值
+    2. 本地数据不足 days 条且接口还有更早数据时，向前翻页补齐
+    """
+    state = get_sync_state(conn, code)
+    synced_at = datetime.datetime.strptime(state[0], "%Y-%m-%d %H:%M:%S") if state else None
+    try:
+        if not synced_at or (datetime.datetime.now() - synced_at).total_seconds() > HISTORY_SYNC_INTERVAL:
+            sync_latest(conn, code)
+        if not (state and state[1]) and get_stored_range(conn, code)[2] < days:
+            extend_history(conn, code, days)
+    except Exception as e:
+        conn.rollback()
+        print(f"同步基金{code}历史净值失败: {e}")
+
+# 获取历史净值，返回 [(日期, 单位净值)]，按日期从旧到新
+def get_nav_history(code, days=HISTORY_DAYS, start=None, end=None, limit=None):
+    """
+    先按需同步，再只通过一次索引查询从 fund_history 返回数据
+    days: 本地至少同步的条数，需足以覆盖从 start（或 end）到今天的数据
+    start/end 限定日期范围（含），end 按前缀匹配，返回范围内最新的 limit 条（默认为 days）
+    """
+    conn = get_db()
+    try:
+        ensure_history(conn, code, days)
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT date, nav FROM fund_history WHERE code = ? AND source = 'lsjz' AND date >= ? AND date <= ?
+               ORDER BY date DESC LIMIT ?""",
+            # "~" 大于日期字符串中的所有字符，end + "~" 可包含以 end 开头的所有日期
+            (code, start or "", (end or "9999") + "~", limit or days)
+        )
+        rows = cursor.fetchall()
+    finally:
+        close_db(conn)
+    return [(row[0], row[1]) for row in reversed(rows)]
+
+class HistorySyncer:
+    """
+    后台同步所有持仓基金的历史净值，组合分析只读取本地数据，不在请求中同步
+    独立于估值刷新运行，不占用估值刷新和推送的时间；非交易时段也照常运行，晚间公布的净值当晚即可同步
+    每只基金最多每 HISTORY_SYNC_INTERVAL 秒请求一次上游
+    """
+
+    def __init__(self, interval=HISTORY_SYNC_INTERVAL):
+        self.interval = interval
+        self.rounds = 0
+        self.last_sync = None
+        self.last_count = 0
+        self._task = None
+
+    # 同步一轮，返回持仓基金数量
+    def sync_once(self):
+        conn = get_db()
+        try:
+            codes = [row[0] for row in conn.execute("SELECT DISTINCT code FROM funds")]
+            for code in codes:
+                ensure_history(conn, code)
+        finally:
+            close_db(conn)
+        self.rounds += 1
+        self.last_count = len(codes)
+        self.last_sync = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return len(codes)
+
+    async def run(self):
+        while True:
+            try:
+                await run_in_threadpool(self.sync_once)
+            except Exception as e:
+                print(f"同步历史净值失败: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval": self.interval,
+            "rounds": self.rounds,
+            "codes": self.last_count,
+            "last_sync": self.last_sync,
+        }
+
+# 全局的历史净值同步任务
+history_syncer = HistorySyncer()
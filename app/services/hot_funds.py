@@ -0,0 +1,115 @@
+import json
+import asyncio
+import hashlib
+import datetime
+import threading
+from starlette.concurrency import run_in_threadpool
+from app.services.estimate_cache import estimate_cache
+from app.services.estimate_refresher import estimate_refresher
+from app.services.fund_service import load_hot_funds
+from app.services.fund_classification import fund_classifier
+
+# 非交易时段没有新的估值，最长等待该时间（秒）后重建一次，使热门基金列表的修改生效
+HOT_FUNDS_REBUILD_INTERVAL = 300
+
+# 估算涨跌幅，没有估值时为 None
+def _change(estimate):
+    try:
+        return float(estimate["estimate_change"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+# 生成热门基金榜单，估值只读取缓存，按估算涨跌幅从高到低排列，没有估值的排在最后
+def build_board(funds):
+    rows = []
+    for fund in funds:
+        estimate = estimate_cache.peek(fund["code"])
+        change = _change(estimate) if estimate else None
+        if estimate is None:
+            classification = fund_classifier.get(fund["code"])
+            estimate = {
+                "estimate": "0.00",
+                "estimate_change": "0.00",
+                "time": "",
+                "type": classification["type"],
+                "sector": classification["sector"],
+                "stale": True,
+            }
+        rows.append((change, {
+            "code": fund["code"],
+            "name": fund["name"],
+            "estimate": estimate["estimate"],
+            "estimate_change": estimate["estimate_change"],
+            "time": estimate["time"],
+            "type": estimate["type"],
+            "sector": estimate["sector"],
+            "stale": estimate.get("stale", False),
+        }))
+    rows.sort(key=lambda row: (row[0] is None, -(row[0] or 0)))
+    return [row for _, row in rows]
+
+class HotFundBoard:
+    """
+    热门基金榜单快照
+    后台任务在每轮估值刷新后重建榜单并序列化为 JSON，请求直接返回序列化好的内容，不请求上游接口
+    """
+
+    def __init__(self, interval=HOT_FUNDS_REBUILD_INTERVAL):
+        self.interval = interval
+        self.body = None
+        self.etag = None
+        self.count = 0
+        self.last_build = None
+        self._lock = threading.Lock()
+        self._task = None
+
+    # 重建快照，ETag 由内容计算，内容不变时 ETag 也不变
+    def rebuild(self):
+        board = build_board(load_hot_funds())
+        body = json.dumps(board, ensure_ascii=False).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        with self._lock:
+            self.body, self.etag = body, etag
+            self.count = len(board)
+            self.last_build = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return etag
+
+    # 当前快照 (JSON, ETag)，后台任务尚未运行时先生成一次
+    def snapshot(self):
+        if self.body is None:
+            self.rebuild()
+        with self._lock:
+            return self.body, self.etag
+
+    async def run(self):
+        version = estimate_refresher.version
+        while True:
+            try:
+                await run_in_threadpool(self.rebuild)
+            except Exception as e:
+                print(f"生成热门基金榜单失败: {e}")
+            version = await estimate_refresher.wait_for_tick(version, self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "count": self.count,
+            "etag": self.etag,
+            "last_build": self.last_build,
+        }
+
+# 全局的热门基金榜单
+hot_fund_board = HotFundBoard()
@@ -0,0 +1,166 @@
+import time
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 默认超时（连接超时, 读取超时），单位秒
+DEFAULT_TIMEOUT = (3, 5)
+# 连接池缓存的主机数量
+POOL_CONNECTIONS = 16
+# 每个主机保持的最大连接数
+POOL_MAXSIZE = 20
+# 只对连接失败和网关错误重试，读超时不重试，避免成倍放大等待时间
+RETRY = Retry(
+    total=2,
+    connect=2,
+    read=0,
+    backoff_factor=0.2,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset(["GET"]),
+    raise_on_status=False,
+)
+# 熔断器：同一主机连续失败该次数后打开
+BREAKER_FAILURE_THRESHOLD = 5
+# 熔断器打开后首次等待的时间（秒），探测失败后加倍
+BREAKER_RESET_TIMEOUT = 30
+# 熔断器最长等待时间（秒）
+BREAKER_MAX_RESET_TIMEOUT = 300
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36",
+}
+
+# 未指定超时时使用默认超时的连接适配器
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+# 创建带连接池和重试策略的会话
+def create_session():
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=RETRY)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
+# 全局共享的会话，所有上游请求复用其中的 keep-alive 连接
+session = create_session()
+
+class CircuitOpenError(requests.ConnectionError):
+    """上游主机的熔断器处于打开状态，请求未发出"""
+
+class CircuitBreaker:
+    """
+    单个上游主机的熔断器
+    1. 连续失败 failure_threshold 次（超时、连接失败、5xx）后打开，打开期间请求立即失败，不再等待超时
+    2. 等待 reset_timeout 秒后只放行一个探测请求，成功则关闭，失败则重新打开并且等待时间加倍
+    """
+
+    def __init__(self, host, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT, max_reset_timeout=BREAKER_MAX_RESET_TIMEOUT):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._timeout = reset_timeout
+        self._open_until = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._open_until is not None and (self._probing or time.monotonic() < self._open_until)
+
+    # 是否放行本次请求，打开状态等待结束后放行一个探测请求
+    def allow(self):
+        with self._lock:
+            if self._open_until is None:
+                return True
+            if self._probing or time.monotonic() < self._open_until:
+                self.rejected += 1
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._timeout = self.reset_timeout
+            self._open_until = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing:
+                self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+            elif self._open_until is not None or self.failures < self.failure_threshold:
+                return
+            self._probing = False
+            self._open_until = time.monotonic() + self._timeout
+            self.trips += 1
+
+    def stats(self):
+        with self._lock:
+            remaining = self._open_until - time.monotonic() if self._open_until is not None else 0
+            return {
+                "state": "closed" if self._open_until is None else ("half_open" if self._probing or remaining <= 0 else "open"),
+                "failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retry_in": round(max(remaining, 0), 1),
+            }
+
+# 各主机的熔断器
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+# 获取 URL 所属主机的熔断器
+def get_breaker(url):
+    host = urlsplit(url).netloc
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+# URL 所属主机的熔断器是否打开
+def circuit_open(url):
+    return get_breaker(url).is_open
+
+# 各主机熔断器的状态
+def breaker_stats():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.host: breaker.stats() for breaker in breakers}
+
+# 发送 GET 请求，经过所属主机的熔断器
+def http_get(url, **kwargs):
+    breaker = get_breaker(url)
+    if not breaker.allow():
+        raise CircuitOpenError(f"{breaker.host} 熔断中，暂停请求")
+    try:
+        response = session.get(url, **kwargs)
+    except Exception:
+        breaker.record_failure()
+        raise
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+# 关闭连接池
+def close_session():
+    session.close()
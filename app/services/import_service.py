@@ -0,0 +1,196 @@
+import io
+import re
+import csv
+import datetime
+from app.services.estimate_cache import estimate_cache
+
+# 每批校验和写入的行数
+IMPORT_CHUNK_SIZE = 500
+# 返回的逐行错误数量上限，超出部分只计数
+IMPORT_ERROR_LIMIT = 100
+# 依次尝试的文件编码，券商导出的文件常见 GBK 编码
+IMPORT_ENCODINGS = ("utf-8-sig", "gb18030")
+# 表头别名 -> 字段
+IMPORT_COLUMNS = {
+    "code": ("基金代码", "代码", "证券代码", "code", "fund_code"),
+    "name": ("基金名称", "名称", "证券名称", "name", "fund_name"),
+    "amount": ("持有金额", "持仓金额", "金额", "持仓成本", "amount"),
+    "shares": ("持有份额", "持仓份额", "份额", "shares"),
+}
+# 无法识别表头时按列顺序解析
+DEFAULT_COLUMN_ORDER = ("code", "name", "amount", "shares")
+FUND_CODE_PATTERN = re.compile(r"\d{6}")
+
+class ImportResult:
+    """导入统计和逐行错误"""
+
+    def __init__(self):
+        self.added = 0
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, code, message):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_ERROR_LIMIT:
+            self.errors.append({"line": line, "code": code, "error": message})
+
+    def to_dict(self):
+        return {
+            "message": f"导入成功，新增 {self.added} 个基金",
+            "added": self.added,
+            "skipped": self.skipped,
+            "error_count": self.error_count,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+        }
+
+# 根据表头确定各字段所在的列，无法识别代码列时按默认列顺序
+def resolve_columns(header):
+    names = [cell.strip().lower() for cell in header]
+    columns = {}
+    for field, aliases in IMPORT_COLUMNS.items():
+        for alias in aliases:
+            if alias.lower() in names:
+                columns[field] = names.index(alias.lower())
+                break
+    if "code" not in columns:
+        return {field: i for i, field in enumerate(DEFAULT_COLUMN_ORDER)}
+    return columns
+
+# 解析金额、份额，允许千分位逗号，空值为 0
+def parse_number(value):
+    value = (value or "").strip().replace(",", "")
+    if not value:
+        return 0.0
+    number = float(value)
+    if number < 0:
+        raise ValueError("不能为负数")
+    return number
+
+# 缓存中可用的估算净值，没有估值或只有降级数据（上次的估值、模拟数据）时为 None
+def _cached_nav(code):
+    cached = estimate_cache.peek(code) or {}
+    if cached.get("stale"):
+        return None
+    try:
+        nav = float(cached["estimate"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return nav if nav > 0 else None
+
+# 解析一行，返回 (code, name, amount, shares)
+def parse_row(row, columns):
+    def cell(field):
+        index = columns.get(field)
+        return row[index].strip() if index is not None and index < len(row) else ""
+
+    code = cell("code")
+    if not FUND_CODE_PATTERN.fullmatch(code):
+        raise ValueError("基金代码应为6位数字")
+    try:
+        amount = parse_number(cell("amount"))
+    except ValueError as e:
+        raise ValueError(f"金额无效: {e}")
+    try:
+        shares = parse_number(cell("shares"))
+    except ValueError as e:
+        raise ValueError(f"份额无效: {e}")
+    # 只有金额或只有份额时按缓存中的估算净值折算另一项，不为导入请求上游接口
+    # 没有可用的估值时报错，不写入净值为 0 的期初交易（交易流水只能追加，写入后无法更正）
+    if (amount > 0) != (shares > 0):
+        nav = _cached_nav(code)
+        if nav is None:
+            raise ValueError("暂无该基金的估算净值，请同时填写持有金额和持有份额")
+        if amount > 0:
+            shares = amount / nav
+        else:
+            amount = shares * nav
+    return code, cell("name") or code, amount, shares
+
+# 写入一批持仓：一次查询校验已存在的代码，一次 executemany 写入，并为有持仓的基金记录期初交易
+def write_chunk(conn, user_id, chunk, seen, result):
+    codes = list({row[1][0] for row in chunk})
+    placeholders = ",".join("?" * len(codes))
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT code FROM funds WHERE user_id = ? AND code IN ({placeholders})", [user_id] + codes)
+    existing = {row[0] for row in cursor.fetchall()}
+
+    rows = []
+    for line, (code, name, amount, shares) in chunk:
+        if code in existing or code in seen:
+            result.skipped += 1
+            result.error(line, code, "基金已存在")
+            continue
+        seen.add(code)
+        rows.append((user_id, code, name, amount, shares))
+
+    before = conn.total_changes
+    cursor.executemany(
+        """INSERT INTO funds (user_id, code, name, amount, shares) VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(user_id, code) DO NOTHING""",
+        rows
+    )
+    result.added += conn.total_changes - before
+
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor.executemany(
+        """INSERT INTO transactions (user_id, code, side, shares, nav, amount, created_at)
+           VALUES (?, ?, 'buy', ?, ?, ?, ?)""",
+        [
+            (user_id, code, shares, amount / shares, amount, now)
+            for user_id, code, name, amount, shares in rows
+            if amount > 0 and shares > 0
+        ]
+    )
+
+# 逐行读取并分批写入，不提交事务
+def _import_stream(conn, user_id, text):
+    result = ImportResult()
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return result
+    columns = resolve_columns(header)
+
+    seen = set()
+    chunk = []
+    for row in reader:
+        line = reader.line_num
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            chunk.append((line, parse_row(row, columns)))
+        except ValueError as e:
+            result.error(line, row[columns["code"]].strip() if columns["code"] < len(row) else "", str(e))
+            continue
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            write_chunk(conn, user_id, chunk, seen, result)
+            chunk = []
+    if chunk:
+        write_chunk(conn, user_id, chunk, seen, result)
+    return result
+
+# 流式导入持仓 CSV，整个文件在同一个事务中写入
+def import_holdings(conn, user_id, file):
+    """
+    file: 二进制文件对象，按块解码，内存占用与文件大小无关
+    第一行为表头，支持 基金代码/基金名称/持有金额/持有份额 等列名，无法识别时按列顺序解析
+    依次尝试 UTF-8 和 GB18030 编码
+    """
+    for encoding in IMPORT_ENCODINGS:
+        file.seek(0)
+        text = io.TextIOWrapper(file, encoding=encoding, newline="")
+        try:
+            result = _import_stream(conn, user_id, text)
+        except UnicodeDecodeError:
+            conn.rollback()
+            continue
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            # 不关闭上传文件本身
+            text.detach()
+        conn.commit()
+        return result.to_dict()
+    raise ValueError("无法识别文件编码，请使用 UTF-8 或 GBK 编码的 CSV 文件")
@@ -0,0 +1,93 @@
+import datetime
+
+# 份额小于该值视为已全部卖出，避免浮点误差留下极小的持仓
+SHARES_EPSILON = 1e-6
+# 查询交易流水默认返回的条数
+TRANSACTIONS_LIMIT = 100
+
+class TradeError(ValueError):
+    """交易参数不合法或持仓不足"""
+
+# 根据金额或份额计算成交份额和金额
+def _trade_size(nav, amount=None, shares=None):
+    if nav is None or nav <= 0:
+        raise TradeError("净值必须大于0")
+    if shares is not None:
+        if shares <= 0:
+            raise TradeError("份额必须大于0")
+        return shares, shares * nav
+    if amount is None or amount <= 0:
+        raise TradeError("金额必须大于0")
+    return amount / nav, amount
+
+# 记录一笔交易并增量更新持仓汇总，不提交事务，由调用方决定提交或回滚
+def apply_trade(conn, user_id, code, side, nav, amount=None, shares=None, name=None):
+    """
+    持仓汇总（funds 表）随交易增量更新，读取持仓不需要回放交易流水
+    amount: 持仓成本（移动加权平均成本法）
+    realized_pnl: 累计已实现盈亏，卖出时按 卖出金额 - 卖出部分的成本 计入
+    买入尚未持有的基金时自动新增持仓，name 为空时使用基金代码
+    """
+    trade_shares, trade_amount = _trade_size(nav, amount, shares)
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT amount, shares, realized_pnl FROM funds WHERE user_id = ? AND code = ?", (user_id, code))
+    fund = cursor.fetchone()
+    if fund is None and side == "sell":
+        raise TradeError(f"基金{code}不存在")
+    cost, held, realized = (fund[0] or 0, fund[1] or 0, fund[2] or 0) if fund else (0, 0, 0)
+
+    pnl = 0
+    if side == "buy":
+        new_cost = cost + trade_amount
+        new_shares = held + trade_shares
+    else:
+        if trade_shares > held + SHARES_EPSILON:
+            raise TradeError(f"基金{code}持有份额不足")
+        trade_shares = min(trade_shares, held)
+        trade_amount = trade_shares * nav
+        sold_cost = cost * trade_shares / held if held > 0 else 0
+        pnl = trade_amount - sold_cost
+        new_cost = cost - sold_cost
+        new_shares = held - trade_shares
+        if new_shares < SHARES_EPSILON:
+            new_cost = new_shares = 0
+    realized += pnl
+
+    if fund is None:
+        cursor.execute(
+            "INSERT INTO funds (user_id, code, name, amount, shares, realized_pnl) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, code, name or code, new_cost, new_shares, realized)
+        )
+    else:
+        cursor.execute(
+            "UPDATE funds SET amount = ?, shares = ?, realized_pnl = ? WHERE user_id = ? AND code = ?",
+            (new_cost, new_shares, realized, user_id, code)
+        )
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor.execute(
+        """INSERT INTO transactions (user_id, code, side, shares, nav, amount, realized_pnl, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (user_id, code, side, trade_shares, nav, trade_amount, pnl, now)
+    )
+    return {
+        "id": cursor.lastrowid,
+        "code": code,
+        "side": side,
+        "shares": trade_shares,
+        "nav": nav,
+        "amount": trade_amount,
+        "realized_pnl": pnl,
+        "created_at": now,
+        "holding": {"amount": new_cost, "shares": new_shares, "realized_pnl": realized},
+    }
+
+# 读取某只基金最近的交易流水，按时间从新到旧
+def get_transactions(conn, user_id, code, limit=TRANSACTIONS_LIMIT):
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT id, side, shares, nav, amount, realized_pnl, created_at FROM transactions
+           WHERE user_id = ? AND code = ? ORDER BY id DESC LIMIT ?""",
+        (user_id, code, limit)
+    )
+    return [dict(row) for row in cursor.fetchall()]
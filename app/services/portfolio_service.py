@@ -0,0 +1,328 @@
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.services.history_service import ensure_history
+from app.services.estimate_cache import estimate_cache
+
+# 默认参与计算的交易日数量（约一年）
+ANALYTICS_DAYS = 250
+# 年化使用的每年交易日数
+TRADING_DAYS_PER_YEAR = 252
+# 计算夏普比率使用的年化无风险利率
+RISK_FREE_RATE = 0.02
+# 缓存的分析结果数量
+ANALYTICS_CACHE_SIZE = 256
+# 持仓分布的分组维度：(分类字段, 返回字段)
+BREAKDOWN_DIMENSIONS = (("type", "by_type"), ("sector", "by_sector"), ("company", "by_company"))
+
+# 用户持仓，按基金代码排序
+def load_holdings(conn, user_id):
+    cursor = conn.cursor()
+    cursor.execute("SELECT code, name, amount, shares FROM funds WHERE user_id = ? ORDER BY code", (user_id,))
+    return [(row[0], row[1], row[2] or 0, row[3] or 0) for row in cursor.fetchall()]
+
+# 持仓基金中最新的净值日期
+def get_last_nav_date(conn, codes):
+    if not codes:
+        return None
+    placeholders = ",".join("?" * len(codes))
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT MAX(date) FROM fund_history WHERE code IN ({placeholders}) AND source = 'lsjz'",
+        list(codes)
+    )
+    return cursor.fetchone()[0]
+
+# 一次查询读取所有基金的净值，按日期对齐成矩阵（行: 日期，列: 基金），缺失值为 NaN
+def load_nav_matrix(conn, codes):
+    placeholders = ",".join("?" * len(codes))
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT code, date, nav FROM fund_history WHERE code IN ({placeholders}) AND source = 'lsjz' ORDER BY code, date",
+        list(codes)
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return [], np.empty((0, len(codes)))
+
+    column = {code: i for i, code in enumerate(codes)}
+    row_dates = np.asarray([row[1] for row in rows])
+    dates = np.unique(row_dates)
+    navs = np.full((len(dates), len(codes)), np.nan)
+    navs[np.searchsorted(dates, row_dates), [column[row[0]] for row in rows]] = [row[2] for row in rows]
+    return dates.tolist(), navs
+
+# 填补停牌、节假日等造成的缺失：先沿用前一日净值，开头缺失的用第一个有效净值补齐
+def fill_gaps(navs):
+    valid = ~np.isnan(navs)
+    index = np.where(valid, np.arange(len(navs))[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    filled = navs[index, np.arange(navs.shape[1])]
+    first = navs[valid.argmax(axis=0), np.arange(navs.shape[1])]
+    return np.where(np.isnan(filled), first, filled)
+
+# 按列计算最大回撤
+def max_drawdown(values):
+    return values / np.maximum.accumulate(values, axis=0) - 1
+
+# 年化波动率和夏普比率，数据不足时为 NaN
+def annualized_risk(returns):
+    if len(returns) < 2:
+        nan = np.full(returns.shape[1:], np.nan)
+        return nan, nan
+    volatility = returns.std(axis=0, ddof=1) * math.sqrt(TRADING_DAYS_PER_YEAR)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = (returns.mean(axis=0) * TRADING_DAYS_PER_YEAR - RISK_FREE_RATE) / volatility
+    return volatility, np.where(volatility > 0, sharpe, np.nan)
+
+# 数组转为列表，NaN、无穷大转为 None
+def _clean(values, digits=6):
+    values = np.asarray(values, dtype=np.float64)
+    return [round(value, digits) + 0.0 if math.isfinite(value) else None for value in values.tolist()]
+
+def _scalar(value, digits=6):
+    return _clean([value], digits)[0]
+
+# 计算组合分析指标
+def compute_analytics(dates, navs, codes, names, amounts, shares):
+    """
+    dates: 日期列表，navs: 已填补缺失的净值矩阵（行: 日期，列: 基金）
+    持仓份额为 0 的基金按持仓金额和最新净值折算份额；整个组合都没有持仓时按等金额计算
+    """
+    latest = navs[-1]
+    shares = np.where(shares > 0, shares, amounts / latest)
+    weighting = "holdings"
+    if not np.any(shares > 0):
+        shares = 1 / latest
+        weighting = "equal"
+
+    # 组合每日市值、盈亏和收益率
+    values = navs @ shares
+    daily_pnl = np.diff(values, prepend=values[0])
+    returns = navs[1:] / navs[:-1] - 1
+    portfolio_returns = (values[1:] / values[:-1] - 1)[:, None]
+    cumulative_return = values / values[0] - 1
+
+    drawdown = max_drawdown(values)
+    trough = int(drawdown.argmin())
+    peak = int(values[:trough + 1].argmax())
+    volatility, sharpe = annualized_risk(portfolio_returns)
+
+    # 各基金指标，按列一次算出
+    fund_values = navs[-1] * shares
+    fund_volatility, fund_sharpe = annualized_risk(returns)
+    fund_drawdown = max_drawdown(navs).min(axis=0)
+    fund_return = navs[-1] / navs[0] - 1
+    fund_pnl = (navs[-1] - navs[0]) * shares
+
+    if len(codes) == 1:
+        correlation = np.ones((1, 1))
+    elif len(returns) >= 2:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = np.corrcoef(returns, rowvar=False)
+    else:
+        correlation = np.full((len(codes), len(codes)), np.nan)
+
+    return {
+        "as_of": dates[-1],
+        "days": len(dates),
+        "weighting": weighting,
+        "summary": {
+            "value": _scalar(values[-1], 2),
+            "pnl": _scalar(values[-1] - values[0], 2),
+            "total_return": _scalar(cumulative_return[-1]),
+            "max_drawdown": _scalar(drawdown[trough]),
+            "max_drawdown_peak": dates[peak],
+            "max_drawdown_trough": dates[trough],
+            "volatility": _scalar(volatility[0]),
+            "sharpe": _scalar(sharpe[0], 4),
+        },
+        "series": {
+            "date": dates,
+            "value": _clean(values, 2),
+            "daily_pnl": _clean(daily_pnl, 2),
+            "cumulative_return": _clean(cumulative_return),
+        },
+        "funds": [
+            {
+                "code": code,
+                "name": name,
+                "shares": share,
+                "value": value,
+                "weight": weight,
+                "pnl": pnl,
+                "total_return": total_return,
+                "volatility": fund_vol,
+                "max_drawdown": fund_mdd,
+                "sharpe": fund_sr,
+            }
+            for code, name, share, value, weight, pnl, total_return, fund_vol, fund_mdd, fund_sr in zip(
+                codes, names, _clean(shares, 4), _clean(fund_values, 2), _clean(fund_values / fund_values.sum()),
+                _clean(fund_pnl, 2), _clean(fund_return), _clean(fund_volatility), _clean(fund_drawdown), _clean(fund_sharpe, 4)
+            )
+        ],
+        "correlation": {
+            "codes": codes,
+            "matrix": [_clean(row, 4) for row in correlation],
+        },
+    }
+
+class AnalyticsCache:
+    """
+    组合分析结果缓存
+    键包含用户、持仓和最新净值日期，只有持仓变化或新净值入库时才重新计算
+    """
+
+    def __init__(self, maxsize=ANALYTICS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+# 全局的组合分析缓存
+analytics_cache = AnalyticsCache()
+
+# 获取用户的组合分析
+def get_portfolio_analytics(conn, user_id, days=ANALYTICS_DAYS):
+    holdings = load_holdings(conn, user_id)
+    codes = [holding[0] for holding in holdings]
+    # 先按本地数据查缓存，命中时不同步历史净值；持仓基金的净值由后台任务定期同步
+    cached = analytics_cache.get((user_id, get_last_nav_date(conn, codes), tuple(holdings), days))
+    if cached is not None:
+        return cached
+
+    # 未命中时补齐计算所需的历史净值
+    for code in codes:
+        ensure_history(conn, code, days)
+    last_date = get_last_nav_date(conn, codes)
+    key = (user_id, last_date, tuple(holdings), days)
+
+    dates, navs = load_nav_matrix(conn, codes) if codes else ([], np.empty((0, 0)))
+    dates, navs = dates[-days:], navs[-days:]
+    # 本地没有净值的基金不参与计算
+    available = ~np.all(np.isnan(navs), axis=0) if len(dates) else np.zeros(len(codes), dtype=bool)
+    missing = [code for code, ok in zip(codes, available) if not ok]
+    if not available.any():
+        result = {"as_of": last_date, "days": 0, "missing": missing}
+    else:
+        selected = [holding for holding, ok in zip(holdings, available) if ok]
+        result = compute_analytics(
+            dates,
+            fill_gaps(navs[:, available]),
+            [holding[0] for holding in selected],
+            [holding[1] for holding in selected],
+            np.asarray([holding[2] for holding in selected], dtype=np.float64),
+            np.asarray([holding[3] for holding in selected], dtype=np.float64),
+        )
+        result["missing"] = missing
+    analytics_cache.put(key, result)
+    return result
+
+# 全局的持仓分布缓存
+breakdown_cache = AnalyticsCache()
+
+# 一次查询读取持仓及其分类，未分类的基金归为 "其他"
+def load_classified_holdings(conn, user_id):
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT f.code, f.name, f.amount, f.shares, c.type, c.sector, c.company FROM funds f
+           LEFT JOIN fund_classification c ON c.code = f.code WHERE f.user_id = ? ORDER BY f.code""",
+        (user_id,)
+    )
+    return [
+        (code, name, amount or 0, shares or 0, fund_type or "其他", sector or "其他", company or "其他")
+        for code, name, amount, shares, fund_type, sector, company in cursor.fetchall()
+    ]
+
+# 缓存中的估算净值和涨跌幅（%），没有估值或只有降级数据（上次的估值、模拟数据）时为 None
+def _cached_estimate(code):
+    cached = estimate_cache.peek(code) or {}
+    if cached.get("stale"):
+        return None, None, None
+    try:
+        return float(cached["estimate"]), float(cached["estimate_change"]), cached.get("time")
+    except (KeyError, TypeError, ValueError):
+        return None, None, None
+
+# 按类型、板块、基金公司汇总持仓市值、权重和今日估算盈亏
+def compute_breakdown(holdings, estimates):
+    """
+    holdings: load_classified_holdings 的结果，estimates: 与之对应的 (估算净值, 涨跌幅, 估算时间)
+    有份额和估值时按 份额 × 估算净值 计算市值，否则按持仓金额计算，今日盈亏为 0，并列入 missing
+    """
+    groups = {key: {} for _, key in BREAKDOWN_DIMENSIONS}
+    total_value = total_cost = total_pnl = 0.0
+    missing = []
+    as_of = None
+    for (code, name, amount, shares, fund_type, sector, company), (nav, change, time) in zip(holdings, estimates):
+        if nav is None:
+            missing.append(code)
+        value = shares * nav if nav is not None and shares > 0 else amount
+        pnl = value * change / (100 + change) if change is not None and change > -100 else 0.0
+        total_value += value
+        total_cost += amount
+        total_pnl += pnl
+        if time and (as_of is None or time > as_of):
+            as_of = time
+        labels = {"type": fund_type, "sector": sector, "company": company}
+        for field, key in BREAKDOWN_DIMENSIONS:
+            group = groups[key].setdefault(labels[field], {"name": labels[field], "count": 0, "value": 0.0, "cost": 0.0, "today_pnl": 0.0})
+            group["count"] += 1
+            group["value"] += value
+            group["cost"] += amount
+            group["today_pnl"] += pnl
+
+    result = {
+        "as_of": as_of,
+        "count": len(holdings),
+        "total_value": _scalar(total_value, 2),
+        "total_cost": _scalar(total_cost, 2),
+        "today_pnl": _scalar(total_pnl, 2),
+        "missing": missing,
+    }
+    for _, key in BREAKDOWN_DIMENSIONS:
+        items = sorted(groups[key].values(), key=lambda group: group["value"], reverse=True)
+        for group in items:
+            start = group["value"] - group["today_pnl"]
+            group["weight"] = _scalar(group["value"] / total_value if total_value else 0)
+            group["today_pnl_rate"] = _scalar(group["today_pnl"] / start if start else 0)
+            group["value"] = _scalar(group["value"], 2)
+            group["cost"] = _scalar(group["cost"], 2)
+            group["today_pnl"] = _scalar(group["today_pnl"], 2)
+        result[key] = items
+    return result
+
+# 获取用户的持仓分布，只读取缓存中的估值，不请求上游接口
+def get_portfolio_breakdown(conn, user_id):
+    holdings = load_classified_holdings(conn, user_id)
+    estimates = [_cached_estimate(holding[0]) for holding in holdings]
+    # 持仓、分类或估值任一变化都会得到新的键
+    key = (user_id, tuple(holdings), tuple(estimates))
+    cached = breakdown_cache.get(key)
+    if cached is not None:
+        return cached
+    result = compute_breakdown(holdings, estimates)
+    breakdown_cache.put(key, result)
+    return result
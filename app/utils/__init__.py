@@ -1,5 +1,8 @@
 import jwt
+import asyncio
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from fastapi import HTTPException, status
 from typing import Optional
@@ -9,8 +12,21 @@ SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# bcrypt 计算成本，修改后旧哈希会在用户下次登录时重新计算
+BCRYPT_ROUNDS = 12
+# 密码哈希线程数
+PASSWORD_WORKERS = 4
+# 排队中（含正在计算）的密码哈希任务上限，超过后直接拒绝请求
+PASSWORD_QUEUE_LIMIT = 64
+
 # 密码加密上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 # 验证密码
 def verify_password(plain_password, hashed_password):
@@ -20,6 +36,80 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# 验证密码，哈希成本参数变化时同时返回新哈希（无需更新时为 None）
+def verify_and_update_password(plain_password, hashed_password):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+class PasswordHasher:
+    """
+    在独立的线程池中计算 bcrypt，避免阻塞事件循环
+    排队任务超过 PASSWORD_QUEUE_LIMIT 时返回 503，防止登录高峰拖垮其他请求
+    """
+
+    def __init__(self, workers=PASSWORD_WORKERS, queue_limit=PASSWORD_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.max_pending = 0
+
+    def _call(self, func, *args):
+        with self._lock:
+            self.running += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self.pending >= self.queue_limit:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="服务繁忙，请稍后重试",
+                    headers={"Retry-After": "1"},
+                )
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._call, func, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    async def hash(self, password):
+        return await self.run(get_password_hash, password)
+
+    async def verify_and_update(self, plain_password, hashed_password):
+        return await self.run(verify_and_update_password, plain_password, hashed_password)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "pending": self.pending,
+                "running": self.running,
+                "queued": self.pending - self.running,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "rounds": BCRYPT_ROUNDS,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+password_hasher = PasswordHasher()
+
 # 创建访问令牌
 def create_access_token(data: dict, expires_delta: Optional[datetime.timedelta] = None):
     to_encode = data.copy()
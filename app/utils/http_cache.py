@@ -0,0 +1,60 @@
+import json
+import hashlib
+import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Response
+from app.utils.market import CHINA_TZ
+
+# 根据数据版本生成弱 ETag，版本相同则 ETag 相同，与响应的具体字节无关
+def make_etag(*version):
+    digest = hashlib.sha1(json.dumps(version, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    return 'W/"' + digest.hexdigest()[:32] + '"'
+
+# 请求参数组成的版本标识，参数顺序不影响结果
+def request_key(request):
+    return request.url.path, sorted(request.query_params.multi_items())
+
+# 转为 HTTP 日期，不带时区的时间按北京时间处理；支持 YYYY-MM-DD、YYYY-MM-DD HH:MM[:SS] 格式的字符串
+def http_date(value):
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.strip())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=CHINA_TZ)
+    return format_datetime(value.astimezone(datetime.timezone.utc).replace(microsecond=0), usegmt=True)
+
+# 缓存相关的响应头，private 表示按用户区分的接口，共享缓存不能混用不同用户的响应
+def cache_headers(etag, max_age, last_modified=None, private=False):
+    scope = "private" if private else "public"
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"{scope}, max-age={max_age}" if max_age > 0 else f"{scope}, no-cache",
+    }
+    if last_modified:
+        try:
+            headers["Last-Modified"] = http_date(last_modified)
+        except (TypeError, ValueError):
+            pass
+    if private:
+        headers["Vary"] = "Authorization"
+    return headers
+
+# 判断条件请求是否命中：优先比较 If-None-Match（弱比较），没有时再比较 If-Modified-Since
+def _is_not_modified(request, headers):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = headers["ETag"].removeprefix("W/")
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and "Last-Modified" in headers:
+        try:
+            return parsedate_to_datetime(headers["Last-Modified"]) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+# 条件请求命中时返回 304 响应，否则返回 None
+def not_modified(request, headers):
+    if _is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    return None
@@ -0,0 +1,35 @@
+import datetime
+
+# A股交易时间（北京时间，无夏令时）
+CHINA_TZ = datetime.timezone(datetime.timedelta(hours=8))
+TRADING_SESSIONS = (
+    (datetime.time(9, 30), datetime.time(11, 30)),
+    (datetime.time(13, 0), datetime.time(15, 0)),
+)
+
+# 获取当前北京时间
+def china_now():
+    return datetime.datetime.now(CHINA_TZ)
+
+# 判断是否处于交易时段（不考虑节假日）
+def is_trading_time(now=None):
+    now = now or china_now()
+    if now.weekday() >= 5:
+        return False
+    current = now.time()
+    return any(start <= current < end for start, end in TRADING_SESSIONS)
+
+# 距离下一个交易时段开始的秒数，交易时段内返回0
+def seconds_until_next_session(now=None):
+    now = now or china_now()
+    if is_trading_time(now):
+        return 0
+    day = now
+    for _ in range(8):
+        if day.weekday() < 5:
+            for start, _end in TRADING_SESSIONS:
+                opening = day.replace(hour=start.hour, minute=start.minute, second=0, microsecond=0)
+                if opening > now:
+                    return (opening - now).total_seconds()
+        day = (day + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return 24 * 3600
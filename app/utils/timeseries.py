@@ -0,0 +1,265 @@
+import json
+import struct
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from fastapi import Query, Response
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，未安装时使用标准库 json
+    orjson = None
+
+# 时间序列接口支持的返回格式
+# json: 每行一个对象（默认，兼容旧前端）
+# columnar: 每列一个数组
+# binary: 二进制，列数据为小端 float32
+SERIES_FORMATS = ("json", "columnar", "binary")
+SERIES_FORMAT_PATTERN = "^(json|columnar|binary)$"
+# 二进制格式的魔数和版本
+BINARY_MAGIC = b"FTS1"
+# 降采样方法：lttb 保留视觉形状，minmax 保留每个分桶的最高点和最低点
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+DOWNSAMPLE_METHOD_PATTERN = "^(lttb|minmax)$"
+# 缓存的预聚合序列数量
+RESAMPLE_CACHE_SIZE = 256
+
+# 序列化为 JSON 响应，优先使用 orjson（可直接序列化 NumPy 数组）
+def json_response(payload):
+    if orjson is not None:
+        body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        body = json.dumps(payload, ensure_ascii=False, default=lambda value: value.tolist()).encode("utf-8")
+    return Response(content=body, media_type="application/json")
+
+# 把行数据转成列：标签列为字符串列表，数值列为 float64 数组
+def to_columns(rows, label_field, value_fields):
+    count = len(rows)
+    labels = [row[label_field] for row in rows]
+    values = {
+        field: np.fromiter((row[field] for row in rows), dtype=np.float64, count=count)
+        for field in value_fields
+    }
+    return labels, values
+
+# 把列还原成行数据
+def to_rows(labels, values, label_field):
+    columns = {field: column.tolist() for field, column in values.items()}
+    return [
+        dict([(label_field, label)] + [(field, column[i]) for field, column in columns.items()])
+        for i, label in enumerate(labels)
+    ]
+
+# 按标签筛选时间范围，end 按前缀比较（to=2024-01-05 包含当天所有分钟）
+def filter_range(rows, label_field, start=None, end=None):
+    if start:
+        rows = [row for row in rows if row[label_field] >= start]
+    if end:
+        rows = [row for row in rows if row[label_field][:len(end)] <= end]
+    return rows
+
+# 分钟级分桶：按 size 分钟取整
+def _minute_bucket(size):
+    def key(label):
+        minute = int(label[11:13]) * 60 + int(label[14:16])
+        minute -= minute % size
+        return f"{label[:11]}{minute // 60:02d}:{minute % 60:02d}"
+    return key
+
+# 周分桶：归到当周周一
+def _week_bucket(label):
+    day = datetime.date.fromisoformat(label[:10])
+    return (day - datetime.timedelta(days=day.weekday())).isoformat()
+
+# 预聚合周期 -> 分桶键
+RESAMPLE_INTERVALS = {
+    "5m": _minute_bucket(5),
+    "15m": _minute_bucket(15),
+    "1h": _minute_bucket(60),
+    "1w": _week_bucket,
+    "1M": lambda label: label[:7],
+}
+# 分钟数据可用的聚合周期
+MINUTE_INTERVAL_PATTERN = "^(5m|15m|1h)$"
+# 日数据可用的聚合周期
+DAILY_INTERVAL_PATTERN = "^(1w|1M)$"
+
+# 按周期聚合 K 线：open 取首个，high 取最大，low 取最小，其余字段取最后一个
+def resample(labels, values, interval):
+    if not labels:
+        return labels, values
+    keys = np.asarray([RESAMPLE_INTERVALS[interval](label) for label in labels])
+    boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(labels)]))
+
+    resampled = {}
+    for field, column in values.items():
+        if field == "open":
+            resampled[field] = column[starts]
+        elif field == "high":
+            resampled[field] = np.maximum.reduceat(column, starts)
+        elif field == "low":
+            resampled[field] = np.minimum.reduceat(column, starts)
+        else:
+            resampled[field] = column[ends - 1]
+    return keys[starts].tolist(), resampled
+
+class ResampleCache:
+    """
+    预聚合结果缓存，键包含原始序列的长度、首尾标签和最后一个值
+    原始序列有新数据或最后一根 K 线被更新时自动失效
+    """
+
+    def __init__(self, maxsize=RESAMPLE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resample(self, series_key, labels, values, interval):
+        last = tuple(float(column[-1]) for column in values.values()) if labels else ()
+        key = (series_key, interval, len(labels), labels[0] if labels else None, labels[-1] if labels else None, last)
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+        result = resample(labels, values, interval)
+        with self._lock:
+            self._data[key] = result
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return result
+
+resample_cache = ResampleCache()
+
+# LTTB（Largest-Triangle-Three-Buckets）降采样，返回保留点的下标
+def lttb_indices(y, threshold):
+    count = len(y)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    x = np.arange(count, dtype=np.float64)
+    # 首尾两点固定保留，中间的点平均分到 threshold - 2 个桶
+    every = (count - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = count - 1
+    starts, ends = edges[:-1], edges[1:]
+    # 用前缀和一次算出每个桶的平均点，作为下一个桶的参考点
+    cumsum = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = ends - starts
+    avg_y = np.append((cumsum[ends] - cumsum[starts]) / sizes, y[-1])
+    avg_x = np.append((starts + ends - 1) / 2.0, x[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, count - 1
+    anchor = 0
+    for i in range(threshold - 2):
+        lo, hi = starts[i], ends[i]
+        # 与上一个选中点、下一桶平均点组成的三角形面积最大的点
+        area = np.abs(
+            (x[anchor] - avg_x[i + 1]) * (y[lo:hi] - y[anchor])
+            - (x[anchor] - x[lo:hi]) * (avg_y[i + 1] - y[anchor])
+        )
+        anchor = lo + int(np.argmax(area))
+        selected[i + 1] = anchor
+    return selected
+
+# 最大最小值分桶降采样，返回保留点的下标
+def minmax_indices(y, threshold):
+    count = len(y)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    buckets = max(1, (threshold - 2) // 2)
+    bucket_ids = np.arange(count) * buckets // count
+    order = np.lexsort((y, bucket_ids))
+    group_starts = np.flatnonzero(np.diff(bucket_ids[order], prepend=-1))
+    group_ends = np.append(group_starts[1:], count) - 1
+    picked = np.concatenate(([0, count - 1], order[group_starts], order[group_ends]))
+    return np.unique(picked)
+
+# 降采样到不超过 points 个点，y_field 为决定形状的数值列
+def downsample(labels, values, points, y_field, method="lttb"):
+    if not points or len(labels) <= points:
+        return labels, values
+    pick = lttb_indices if method == "lttb" else minmax_indices
+    indices = pick(values[y_field], points)
+    return [labels[i] for i in indices], {field: column[indices] for field, column in values.items()}
+
+# 列式 JSON：{..., "length": n, "columns": {"date": [...], "price": [...]}}
+def columnar_payload(meta, labels, values, label_field):
+    columns = {label_field: labels}
+    columns.update(values)
+    payload = dict(meta)
+    payload.update({"format": "columnar", "length": len(labels), "columns": columns})
+    return payload
+
+# 二进制格式：
+# 4 字节魔数 + 4 字节小端 uint32 头部长度 + UTF-8 JSON 头部
+# + 按头部 fields 顺序排列的各列数据（每列 length 个小端 float32）
+def binary_response(meta, labels, values, label_field):
+    header = dict(meta)
+    header.update({
+        "format": "binary",
+        "length": len(labels),
+        "dtype": "<f4",
+        "label": label_field,
+        "labels": labels,
+        "fields": list(values),
+    })
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    body = b"".join(
+        [BINARY_MAGIC, struct.pack("<I", len(header_bytes)), header_bytes]
+        + [np.ascontiguousarray(column, dtype="<f4").tobytes() for column in values.values()]
+    )
+    return Response(content=body, media_type="application/octet-stream")
+
+# 按请求的格式返回时间序列
+def series_response(format, meta, labels, values, rows_key, label_field):
+    """
+    meta: 序列以外的字段（code、name 等）
+    labels/values: 列数据，rows_key 为行格式下的字段名（如 history、minute_data）
+    """
+    if format == "json":
+        payload = dict(meta)
+        payload[rows_key] = to_rows(labels, values, label_field)
+        return json_response(payload)
+    if format == "binary":
+        return binary_response(meta, labels, values, label_field)
+    return json_response(columnar_payload(meta, labels, values, label_field))
+
+class SeriesParams:
+    """
+    时间序列接口的公共查询参数，作为依赖注入使用
+    """
+
+    def __init__(
+        self,
+        format: str = Query("json", pattern=SERIES_FORMAT_PATTERN, description="返回格式：json、columnar、binary"),
+        start: Optional[str] = Query(None, alias="from", description="起始时间（含），如 2024-01-01"),
+        end: Optional[str] = Query(None, alias="to", description="结束时间（含），按前缀匹配，如 2024-01-31"),
+        points: Optional[int] = Query(None, ge=3, le=10000, description="最多返回的点数，超过时在服务端降采样"),
+        method: str = Query("lttb", pattern=DOWNSAMPLE_METHOD_PATTERN, description="降采样方法：lttb、minmax"),
+    ):
+        self.format = format
+        self.start = start
+        self.end = end
+        self.points = points
+        self.method = method
+
+# 处理时间序列请求：时间范围筛选 -> 预聚合 -> 降采样 -> 按格式返回
+def build_series_response(rows, meta, rows_key, label_field, value_fields, y_field, params,
+                          interval=None, series_key=None, display_label=None):
+    """
+    y_field: 降采样时决定曲线形状的数值列
+    series_key: 标识原始序列，用于缓存预聚合结果
+    display_label: 输出前转换标签（如分钟数据只显示 HH:MM）
+    """
+    rows = filter_range(rows, label_field, params.start, params.end)
+    labels, values = to_columns(rows, label_field, value_fields)
+    if interval:
+        labels, values = resample_cache.resample((series_key, params.start, params.end), labels, values, interval)
+    labels, values = downsample(labels, values, params.points, y_field, params.method)
+    if display_label:
+        labels = [display_label(label) for label in labels]
+    return series_response(params.format, meta, labels, values, rows_key, label_field)
@@ -1,29 +1,51 @@
+import sys
 import sqlite3
-
-DATABASE = "funds.db"
+from app.database import DATABASE
+from app.database.migrations import migrate, get_version, check_query_plans
 
 def migrate_db():
-    """迁移数据库，添加 amount 列"""
+    """执行尚未执行的数据库迁移"""
     conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
     try:
-        # 检查 amount 列是否存在
-        cursor.execute("PRAGMA table_info(funds)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if "amount" not in columns:
-            # 添加 amount 列
-            cursor.execute("ALTER TABLE funds ADD COLUMN amount REAL DEFAULT 0")
-            print("成功添加 amount 列到 funds 表")
-        else:
-            print("amount 列已存在")
-        
-        conn.commit()
+        applied = migrate(conn)
+        for migration in applied:
+            print(f"已执行迁移 {migration.version}: {migration.description}")
+        if not applied:
+            print("数据库已是最新版本")
+        print(f"当前数据库版本: {get_version(conn)}")
     except Exception as e:
         print(f"迁移失败: {e}")
     finally:
         conn.close()
 
+def check_db():
+    """检查迁移声明的查询是否都走索引，存在全表扫描时返回非零退出码"""
+    conn = sqlite3.connect(DATABASE)
+    try:
+        failures = check_query_plans(conn)
+    finally:
+        conn.close()
+    for version, sql, scans in failures:
+        print(f"迁移 {version} 的查询出现全表扫描: {sql} -> {scans}")
+    if not failures:
+        print("所有查询均使用索引")
+    return 1 if failures else 0
+
+def refresh_funds():
+    """从天天基金全量刷新本地基金列表和基金分类"""
+    from app.services.fund_master import refresh_fund_master, get_held_codes
+    from app.services.fund_classification import refresh_classification
+    try:
+        print(f"已刷新基金列表: {refresh_fund_master()} 条")
+        print(f"已刷新基金分类: {refresh_classification(get_held_codes())} 条")
+    except Exception as e:
+        print(f"刷新基金列表失败: {e}")
+        return 1
+    return 0
+
 if __name__ == "__main__":
     migrate_db()
+    if "--refresh-funds" in sys.argv and refresh_funds():
+        sys.exit(1)
+    if "--check" in sys.argv:
+        sys.exit(check_db())
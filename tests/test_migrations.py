@@ -0,0 +1,39 @@
+import sqlite3
+from app.database.migrations import MIGRATIONS, migrate, get_version, check_query_plans
+
+# 在新建的数据库上执行全部迁移，检查版本号和所有声明的查询都走索引
+def test_migrations_use_indexes(tmp_path):
+    conn = sqlite3.connect(tmp_path / "funds.db")
+    try:
+        applied = migrate(conn)
+        assert [migration.version for migration in applied] == sorted(migration.version for migration in MIGRATIONS)
+        assert get_version(conn) == MIGRATIONS[-1].version
+        assert check_query_plans(conn) == []
+    finally:
+        conn.close()
+
+# 已是最新版本时再次迁移不执行任何变更
+def test_migrate_is_idempotent(tmp_path):
+    conn = sqlite3.connect(tmp_path / "funds.db")
+    try:
+        migrate(conn)
+        assert migrate(conn) == []
+        assert get_version(conn) == MIGRATIONS[-1].version
+    finally:
+        conn.close()
+
+# 旧数据库中重复的持仓在建立唯一索引前合并，金额和份额不丢失
+def test_duplicate_holdings_are_merged(tmp_path):
+    conn = sqlite3.connect(tmp_path / "funds.db")
+    try:
+        migrate(conn, MIGRATIONS[:1])
+        conn.executemany(
+            "INSERT INTO funds (user_id, code, name, amount, shares) VALUES (?, ?, ?, ?, ?)",
+            [(1, "000001", "a", 100, 80), (1, "000001", "a", 50, None), (2, "000001", "a", 7, 7)]
+        )
+        conn.commit()
+        migrate(conn)
+        rows = conn.execute("SELECT user_id, amount, shares FROM funds WHERE code = '000001' ORDER BY user_id").fetchall()
+        assert rows == [(1, 150, 80), (2, 7, 7)]
+    finally:
+        conn.close()